@@ -1,14 +1,43 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+from functools import lru_cache
+from array import array
 import requests
 import xml.etree.ElementTree as ET
 import os
 import json
-import gzip
+import zlib
 from pathlib import Path
 import threading
 import time
+import shutil
+import tempfile
+import hashlib
+import copy
+import multiprocessing
+import sqlite3
+import bisect
+import calendar
+import html
+import re
+import heapq
+import struct
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'epg-merger-secret-key'
@@ -17,113 +46,2243 @@ app.config['SECRET_KEY'] = 'epg-merger-secret-key'
 DATA_DIR = Path('data')
 DATA_DIR.mkdir(exist_ok=True)
 CONFIG_FILE = DATA_DIR / 'config.json'
+CONFIG_LOCK_FILE = DATA_DIR / 'config.lock'
+SCHEDULER_LOCK_FILE = DATA_DIR / 'scheduler.lock'
+MERGE_LOCK_FILE = DATA_DIR / 'merge.lock'
 EPG_FILES_DIR = DATA_DIR / 'epg_files'
 EPG_FILES_DIR.mkdir(exist_ok=True)
+SOURCE_CACHE_DIR = DATA_DIR / 'source_cache'
+SOURCE_CACHE_DIR.mkdir(exist_ok=True)
+JOBS_DIR = DATA_DIR / 'jobs'
+JOBS_DIR.mkdir(exist_ok=True)
+FRAGMENTS_DIR = DATA_DIR / 'fragments'
+FRAGMENTS_DIR.mkdir(exist_ok=True)
+METRICS_DIR = DATA_DIR / 'metrics'
+METRICS_DIR.mkdir(exist_ok=True)
+VARIANTS_DIR = DATA_DIR / 'variants'
+VARIANTS_DIR.mkdir(exist_ok=True)
+VERSIONS_DIR = DATA_DIR / 'versions'
+VERSIONS_DIR.mkdir(exist_ok=True)
+LOGOS_DIR = DATA_DIR / 'logos'
+LOGOS_DIR.mkdir(exist_ok=True)
+LOGO_INDEX_FILE = LOGOS_DIR / 'index.json'
+
+# Chunk size used when streaming downloads and XML parsing
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Decompressed bytes fed to the XML parser at a time (see iter_xmltv_elements)
+PARSE_FEED_SIZE = 64 * 1024
+
+# Elements serialized per ET.tostring() call (see serialize_elements)
+SERIALIZE_BATCH_SIZE = 500
+
+# Fragments that no merge used for this long are removed
+FRAGMENT_MAX_AGE = 7 * 86400
+
+# Precompressed output variants, in order of server preference
+OUTPUT_ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz'
+}
+DEFAULT_OUTPUT_ENCODINGS = ['gzip']
+
+# Number of published versions kept per EPG file for version downloads and deltas
+DEFAULT_OUTPUT_VERSIONS = 5
+
+# Per-EPG file settings accepted by /api/epg-files/<id>/settings, with their types
+EPG_FILE_SETTINGS = {
+    'pretty_print': bool,
+    'dedupe_programmes': bool,
+    'past_days': float,
+    'future_days': float,
+    'channels': list,
+    'guide_index': bool,
+    'profiles': dict,
+    'cache_logos': bool,
+    'sort_programmes': bool
+}
+
+# Memory used to sort programmes before they are spilled to disk, in MB
+DEFAULT_SORT_MEMORY_BUDGET = 64
+
+# Size limit of the cache of channel-subset variants of the outputs, in MB
+DEFAULT_VARIANT_CACHE_SIZE = 512
+
+# Cached channel logos are downloaded again after LOGO_REFRESH_AGE (failed ones after
+# LOGO_RETRY_AGE) and removed once no merge used them for LOGO_MAX_AGE
+LOGO_REFRESH_AGE = 7 * 86400
+LOGO_RETRY_AGE = 86400
+LOGO_MAX_AGE = 30 * 86400
+LOGO_MAX_SIZE = 1024 * 1024
+# Logos are content-addressed, so clients may cache them for a year
+LOGO_CACHE_MAX_AGE = 365 * 86400
+# <icon src="..."> in a <channel> serialized by serialize_elements()
+CHANNEL_ICON_PATTERN = re.compile(rb'(<icon\b[^>]*?\bsrc=")([^"]*)(")')
+
+# Limits of the guide query API
+GUIDE_SCHEDULE_LIMIT = 1000
+GUIDE_SEARCH_LIMIT = 200
+# Bumped when the guide index schema changes; older indexes are ignored until rebuilt
+GUIDE_SCHEMA_VERSION = 2
+# Texts of a <programme> serialized by serialize_elements() that the guide search indexes
+GUIDE_TEXT_PATTERN = re.compile(rb'<(?:title|sub-title|desc)\b[^>]*>([^<]*)<')
+
+# Download concurrency defaults (can be overridden in config.json)
+DEFAULT_FETCH_CONCURRENCY = 4
+DEFAULT_FETCH_PER_HOST_LIMIT = 2
+# Settings of a source that can be changed with /api/sources/<id>/settings
+SOURCE_SETTINGS = {
+    'refresh_interval': float,
+    'refresh_jitter': float
+}
+# Sources with their own refresh_interval get this fraction of it as jitter by default
+DEFAULT_REFRESH_JITTER_RATIO = 0.1
+# Sources are parsed in this process unless more parse workers are configured
+DEFAULT_PARSE_WORKERS = 1
 
-# Initialize scheduler
+# Initialize scheduler (started by start_background_tasks)
 scheduler = BackgroundScheduler()
-scheduler.start()
-
-# Global job status tracking
-job_status = {
-    'is_running': False,
-    'current_step': '',
-    'progress': 0,
-    'total_steps': 0,
-    'current_epg_file': '',
-    'current_source': '',
-    'sources_completed': 0,
-    'total_sources': 0,
-    'start_time': None,
-    'end_time': None,
-    'error': None
+
+# The scheduler and the publishers of a worker process are started once, never on import,
+# so parse worker processes can import the app without starting them
+background_state = {'started': False}
+background_lock = threading.Lock()
+
+# Only the process holding SCHEDULER_LOCK_FILE (the leader) runs scheduled merges.
+# Every process checks periodically, so another worker takes over if the leader exits.
+LEADER_CHECK_INTERVAL = 15
+leader_state = {
+    'lock_file': None,
+    'schedule_signature': None,
+    'source_schedules': {}
+}
+leader_lock = threading.Lock()
+
+# Merge job history, oldest first, keyed by job id
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+current_job_id = None
+JOB_HISTORY_LIMIT = 50
+
+# Merge jobs run one at a time in the background, in submission order
+job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='merge-job')
+
+# Job changes wake up the job status streams and are published to data/jobs/<pid>.json,
+# so every worker process can report jobs running in another one
+jobs_changed = threading.Condition(jobs_lock)
+job_events = {
+    'version': 0,
+    'published_at': 0,
+    'publish_timer': None
 }
-job_status_lock = threading.Lock()
+jobs_publish_lock = threading.Lock()
+other_jobs_cache = {}
+JOB_PUBLISH_INTERVAL = 0.5
+JOB_STREAM_MAX_DURATION = 300
+JOB_STREAM_KEEPALIVE = 15
+
+# Prometheus metrics of this process: name -> {label items -> value}.
+# Every worker publishes its metrics to data/metrics/<pid>.json and /metrics adds them up.
+METRIC_DEFINITIONS = {
+    'epg_source_fetches_total': ('counter', 'Source fetches by result (downloaded, not_modified, fresh, failed)'),
+    'epg_source_download_bytes_total': ('counter', 'Bytes downloaded per source'),
+    'epg_source_failures_total': ('counter', 'Source failures by stage (download, parse)'),
+    'epg_fragments_total': ('counter', 'Source fragments by result (built, reused)'),
+    'epg_stage_duration_seconds': ('histogram', 'Time spent per merge stage and source'),
+    'epg_elements_total': ('counter', 'Channels and programmes per source by outcome (kept, pruned, duplicate)'),
+    'epg_merges_total': ('counter', 'EPG file merges by result'),
+    'epg_merge_duration_seconds': ('histogram', 'Duration of EPG file merges'),
+    'epg_output_bytes': ('gauge', 'Size of the last merged output per encoding'),
+    'epg_download_requests_total': ('counter', 'Download requests by EPG file and status'),
+    'epg_download_bytes_total': ('counter', 'Bytes served by the download routes by EPG file and encoding'),
+    'epg_logo_fetches_total': ('counter', 'Channel logo downloads by result (downloaded, failed)'),
+    'epg_logo_download_bytes_total': ('counter', 'Bytes of channel logos downloaded'),
+}
+METRIC_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+METRICS_PUBLISH_INTERVAL = 10
+metrics = {}
+metrics_lock = threading.Lock()
+metrics_state = {'changed': False}
+other_metrics_cache = {}
+
+# In-memory copy of config.json, reloaded only when the file changes
+config_cache = {
+    'version': None,
+    'config': None
+}
+config_cache_lock = threading.Lock()
+config_write_lock = threading.Lock()
 
+# last_fetched timestamps waiting to be flushed to config.json, keyed by source id
+pending_last_fetched = {}
+pending_last_fetched_lock = threading.Lock()
 
-def load_config():
-    """Load configuration from file"""
-    if CONFIG_FILE.exists():
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-    else:
-        config = {
+# Content hashes of served files, keyed by path and invalidated on change
+file_etags = {}
+file_etags_lock = threading.Lock()
+
+# Serializes updates of the logo index within a process
+logos_lock = threading.Lock()
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """
+    Hold an exclusive lock on a lock file, shared between processes.
+    Yields False instead of waiting when blocking is False and the lock is taken.
+    Without fcntl (Windows) the lock is a no-op.
+    """
+    if fcntl is None:
+        yield True
+        return
+    
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_config_file():
+    """Read config.json, reusing the cached copy while the file is unchanged"""
+    try:
+        stat = CONFIG_FILE.stat()
+    except FileNotFoundError:
+        return {
             'sources': [],
             'epg_files': [],
             'schedule_interval': 7200  # Default: 2 hours in seconds
         }
     
+    version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with config_cache_lock:
+        if config_cache['version'] == version:
+            return copy.deepcopy(config_cache['config'])
+    
+    with open(CONFIG_FILE, 'r') as f:
+        config = json.load(f)
+    
+    with config_cache_lock:
+        config_cache['version'] = version
+        config_cache['config'] = config
+    return copy.deepcopy(config)
+
+
+def write_config_file(config):
+    """Publish config.json atomically; the caller must hold the config lock"""
+    write_bytes_atomic(CONFIG_FILE, json.dumps(config, indent=2).encode('utf-8'))
+    
+    stat = CONFIG_FILE.stat()
+    with config_cache_lock:
+        config_cache['version'] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        config_cache['config'] = copy.deepcopy(config)
+
+
+@contextmanager
+def config_lock():
+    """Serialize config.json writes between threads and processes"""
+    with config_write_lock, file_lock(CONFIG_LOCK_FILE):
+        yield
+
+
+def load_config():
+    """Load configuration (cached in memory until config.json changes)"""
+    config = read_config_file()
+    
     # Migrate sources without IDs
-    migrated = False
-    for source in config.get('sources', []):
-        if 'id' not in source:
+    if any('id' not in source for source in config.get('sources', [])):
+        def migrate(config):
             import uuid
-            source['id'] = str(uuid.uuid4())
-            migrated = True
-    
-    if migrated:
-        save_config(config)
+            for source in config.get('sources', []):
+                if 'id' not in source:
+                    source['id'] = str(uuid.uuid4())
+        config = update_config(migrate)
     
     return config
 
 
 def save_config(config):
     """Save configuration to file"""
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
+    with config_lock():
+        write_config_file(config)
 
 
-def fetch_xml(url):
-    """Fetch XML content from URL (handles both plain XML and gzipped .xml.gz files)"""
+def update_config(mutate):
+    """
+    Apply a change to the latest configuration and save it, all under the config lock,
+    so concurrent writers cannot overwrite each other's changes. Returns the new config.
+    mutate may return False when there is nothing to change, which skips the write.
+    """
+    with config_lock():
+        config = read_config_file()
+        if mutate(config) is not False:
+            write_config_file(config)
+        return config
+
+
+def write_bytes_atomic(path, data):
+    """Write bytes to a file via a temporary file and rename, so readers never see a partial file"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def inc_metric(name, value=1, **labels):
+    """Increment a counter"""
+    key = tuple(sorted(labels.items()))
+    with metrics_lock:
+        values = metrics.setdefault(name, {})
+        values[key] = values.get(key, 0) + value
+        metrics_state['changed'] = True
+
+
+def set_metric(name, value, **labels):
+    """Set a gauge"""
+    key = tuple(sorted(labels.items()))
+    with metrics_lock:
+        # The time decides which worker's value is the latest
+        metrics.setdefault(name, {})[key] = [value, time.time()]
+        metrics_state['changed'] = True
+
+
+def observe_metric(name, value, **labels):
+    """Record an observation in a histogram"""
+    key = tuple(sorted(labels.items()))
+    with metrics_lock:
+        values = metrics.setdefault(name, {})
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = {'buckets': [0] * len(METRIC_BUCKETS), 'sum': 0, 'count': 0}
+        i = bisect.bisect_left(METRIC_BUCKETS, value)
+        if i < len(METRIC_BUCKETS):
+            histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+        metrics_state['changed'] = True
+
+
+def snapshot_metrics():
+    """Get the metrics of this process in their published JSON form"""
+    with metrics_lock:
+        return {name: [[dict(key), copy.deepcopy(value)] for key, value in values.items()]
+                for name, values in metrics.items()}
+
+
+def publish_metrics():
+    """Write the metrics of this process to data/metrics/<pid>.json when they changed"""
+    with metrics_lock:
+        if not metrics_state['changed']:
+            return
+        metrics_state['changed'] = False
+    data = json.dumps({'pid': os.getpid(), 'start_token': get_process_start_token(os.getpid()),
+                       'metrics': snapshot_metrics()}).encode('utf-8')
+    write_bytes_atomic(METRICS_DIR / f"{os.getpid()}.json", data)
+
+
+def publish_metrics_periodically():
+    """Publish the metrics of this process every METRICS_PUBLISH_INTERVAL seconds"""
+    while True:
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+        try:
+            publish_metrics()
+        except OSError as e:
+            print(f"Error publishing metrics: {str(e)}")
+
+
+def render_metrics():
+    """Render the metrics of all worker processes in the Prometheus text format"""
+    combined = {}
+    snapshots = [snapshot_metrics()]
+    snapshots.extend(snapshot.get('metrics', {}) for snapshot in read_process_snapshots(METRICS_DIR, other_metrics_cache))
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            if name not in METRIC_DEFINITIONS:
+                continue
+            metric_type = METRIC_DEFINITIONS[name][0]
+            values = combined.setdefault(name, {})
+            for labels, value in series:
+                key = tuple(sorted(labels.items()))
+                current = values.get(key)
+                if current is None:
+                    values[key] = copy.deepcopy(value)
+                elif metric_type == 'counter':
+                    values[key] = current + value
+                elif metric_type == 'gauge':
+                    if value[1] > current[1]:
+                        values[key] = value
+                else:
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+    
+    def format_labels(items):
+        if not items:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in items)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+    
+    lines = []
+    for name, (metric_type, description) in METRIC_DEFINITIONS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for key, value in sorted(combined.get(name, {}).items()):
+            if metric_type == 'counter':
+                lines.append(f"{name}{format_labels(key)} {value}")
+            elif metric_type == 'gauge':
+                lines.append(f"{name}{format_labels(key)} {value[0]}")
+            else:
+                cumulative = 0
+                for bound, count in zip(METRIC_BUCKETS, value['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{name}_sum{format_labels(key)} {round(value['sum'], 6)}")
+                lines.append(f"{name}_count{format_labels(key)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def get_source_cache_paths(source_id):
+    """Get the paths of the cached raw payload and its metadata for a source"""
+    return SOURCE_CACHE_DIR / f"{source_id}.raw", SOURCE_CACHE_DIR / f"{source_id}.json"
+
+
+def delete_source_cache(source_id):
+    """Remove the cached payload and the fragments of a source"""
+    for path in get_source_cache_paths(source_id):
+        if path.exists():
+            path.unlink()
+    shutil.rmtree(FRAGMENTS_DIR / source_id, ignore_errors=True)
+
+
+def get_payload_sha256(source_id, payload_path):
+    """Get the SHA-256 of a downloaded payload, recorded while it was downloaded if possible"""
+    _, meta_path = get_source_cache_paths(source_id)
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('sha256') and meta.get('size') == payload_path.stat().st_size:
+            return meta['sha256']
+    except (OSError, ValueError):
+        pass
+    return get_file_etag(payload_path)
+
+
+def parse_cache_control(value):
+    """
+    Parse a Cache-Control header.
+    Returns (max_age, no_store) where max_age is None when the response may not be
+    reused without revalidation.
+    """
+    max_age = None
+    no_store = False
+    for directive in (value or '').lower().split(','):
+        directive = directive.strip()
+        if directive == 'no-store':
+            no_store = True
+        elif directive == 'no-cache':
+            max_age = 0
+        elif directive.startswith('max-age=') and max_age != 0:
+            try:
+                max_age = max(0, int(directive.split('=', 1)[1].strip('"')))
+            except ValueError:
+                pass
+    return max_age, no_store
+
+
+def fetch_source_payload(url, source_id, progress=None):
+    """
+    Download the raw (possibly gzipped) payload of a source to data/source_cache.
+    The response body is streamed to disk in chunks and never held in memory.
+    The ETag/Last-Modified validators are stored next to it, so later fetches are
+    conditional and reuse the stored payload on a 304, or skip the request while
+    Cache-Control allows it. progress(downloaded, total) is called for every chunk
+    with the number of bytes received so far. Returns the path of the payload.
+    """
+    payload_path, meta_path = get_source_cache_paths(source_id)
+    meta = {}
+    if payload_path.exists() and meta_path.exists():
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        if meta.get('url') != url:
+            meta = {}
+    
+    # Still fresh according to the Cache-Control of the last response
+    if meta.get('expires') and time.time() < meta['expires']:
+        print(f"Using cached copy of {url}")
+        inc_metric('epg_source_fetches_total', source=source_id, result='fresh')
+        return payload_path
+    
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    
+    with requests.get(url, headers=headers, timeout=30, stream=True) as response:
+        max_age, no_store = parse_cache_control(response.headers.get('Cache-Control'))
         
-        content = response.content
+        if response.status_code == 304 and meta:
+            print(f"Not modified: {url} - using cached copy")
+            meta['expires'] = time.time() + max_age if max_age else None
+            meta['validated_at'] = datetime.now().isoformat()
+            write_bytes_atomic(meta_path, json.dumps(meta, indent=2).encode('utf-8'))
+            inc_metric('epg_source_fetches_total', source=source_id, result='not_modified')
+            return payload_path
         
-        # Check if content is gzipped (by URL extension or content)
-        if url.endswith('.gz') or content[:2] == b'\x1f\x8b':
-            # Decompress gzipped content
-            content = gzip.decompress(content)
+        response.raise_for_status()
+        
+        # Stream the body to a temporary file and publish it with a rename
+        size = 0
+        digest = hashlib.sha256()
+        content_length = response.headers.get('Content-Length', '')
+        total = int(content_length) if content_length.isdigit() else None
+        tmp_path = payload_path.with_name(f".{payload_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    if progress:
+                        # Bytes on the wire, comparable with Content-Length
+                        progress(response.raw.tell(), total)
+            os.replace(tmp_path, payload_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    
+    inc_metric('epg_source_fetches_total', source=source_id, result='downloaded')
+    inc_metric('epg_source_download_bytes_total', size, source=source_id)
+    
+    if no_store:
+        # Keep the payload for this run only, the next fetch is unconditional
+        if meta_path.exists():
+            meta_path.unlink()
+    else:
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'expires': time.time() + max_age if max_age else None,
+            'size': size,
+            'sha256': digest.hexdigest(),
+            'fetched_at': datetime.now().isoformat(),
+            'validated_at': datetime.now().isoformat()
+        }
+        write_bytes_atomic(meta_path, json.dumps(meta, indent=2).encode('utf-8'))
+    
+    return payload_path
+
+
+class XMLTVTarget:
+    """
+    XML parser target that builds every top-level element of an XMLTV document on its own.
+    Completed <channel>/<programme> elements are collected in `elements` but never attached
+    to the <tv> root, so they are released as soon as the consumer drops them. An optional
+    accept(tag, attrib) callback rejects elements from their start tag, so rejected
+    elements are skipped without ever being built.
+    """
+    
+    def __init__(self, accept=None):
+        self.elements = []
+        self.root_attrib = {}
+        self._accept = accept
+        self._depth = 0
+        self._builder = None
+        self._skipping = False
+    
+    def start(self, tag, attrib):
+        self._depth += 1
+        if self._depth == 1:
+            self.root_attrib = dict(attrib)
+            return
+        if self._depth == 2:
+            if self._accept is not None and not self._accept(tag, attrib):
+                self._skipping = True
+                return
+            self._builder = ET.TreeBuilder()
+        if not self._skipping:
+            self._builder.start(tag, attrib)
+    
+    def end(self, tag):
+        if self._depth >= 2 and not self._skipping:
+            element = self._builder.end(tag)
+            if self._depth == 2:
+                self.elements.append(element)
+                self._builder = None
+        if self._depth == 2:
+            self._skipping = False
+        self._depth -= 1
+    
+    def data(self, data):
+        if self._builder is not None:
+            self._builder.data(data)
+    
+    def close(self):
+        return None
+
+
+def iter_payload_slices(f, timings):
+    """
+    Read a plain or gzipped payload as slices of at most PARSE_FEED_SIZE bytes.
+    Compressed input is inflated no further than one slice ahead, however well it
+    compresses. The seconds spent decompressing are added to timings['decompress'].
+    """
+    gzipped = f.read(2) == b'\x1f\x8b'
+    f.seek(0)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if gzipped else None
+    
+    while True:
+        chunk = f.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        if decompressor is None:
+            for i in range(0, len(chunk), PARSE_FEED_SIZE):
+                yield chunk[i:i + PARSE_FEED_SIZE]
+            continue
         
-        return ET.fromstring(content)
+        while chunk:
+            started = time.perf_counter()
+            data = decompressor.decompress(chunk, PARSE_FEED_SIZE)
+            chunk = decompressor.unconsumed_tail
+            # Feeds may consist of several concatenated gzip members
+            if decompressor.eof and decompressor.unused_data:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            timings['decompress'] += time.perf_counter() - started
+            if data:
+                yield data
+    
+    if decompressor is not None:
+        started = time.perf_counter()
+        data = decompressor.flush()
+        timings['decompress'] += time.perf_counter() - started
+        if data:
+            yield data
+
+
+def iter_xmltv_elements(path, accept=None, timings=None):
+    """
+    Stream the top-level <channel>/<programme> elements of a plain or gzipped XMLTV file.
+    The file is fed to the parser in small slices (see iter_payload_slices), and the
+    elements parsed from a slice are handed out before the next one is fed, so memory use
+    is bounded by one slice worth of elements instead of the size of the feed. Elements
+    rejected by accept(tag, attrib) are skipped at parse time. The seconds spent
+    decompressing and parsing are added to the timings dict, if given.
+    """
+    if timings is None:
+        timings = {}
+    timings.setdefault('decompress', 0)
+    timings.setdefault('parse', 0)
+    target = XMLTVTarget(accept)
+    parser = ET.XMLParser(target=target)
+    
+    with open(path, 'rb') as f:
+        for data in iter_payload_slices(f, timings):
+            started = time.perf_counter()
+            parser.feed(data)
+            timings['parse'] += time.perf_counter() - started
+            if target.elements:
+                elements, target.elements = target.elements, []
+                yield from elements
+    
+    started = time.perf_counter()
+    parser.close()
+    timings['parse'] += time.perf_counter() - started
+    yield from target.elements
+
+
+def fetch_source(url, source_id, progress=None):
+    """Download a source, returning the path of its payload or None on failure"""
+    try:
+        return fetch_source_payload(url, source_id, progress)
     except Exception as e:
         print(f"Error fetching {url}: {str(e)}")
+        inc_metric('epg_source_fetches_total', source=source_id, result='failed')
+        inc_metric('epg_source_failures_total', source=source_id, stage='download')
+        return None
+
+
+@lru_cache(maxsize=65536)
+def parse_xmltv_time(value):
+    """
+    Convert an XMLTV timestamp such as "20240101120000 +0100" to a UTC epoch.
+    Missing fields default to their lowest value and a missing offset means UTC.
+    Returns None when the value cannot be parsed.
+    """
+    if not value:
+        return None
+    
+    value = value.strip()
+    digits_end = 0
+    while digits_end < len(value) and value[digits_end].isdigit():
+        digits_end += 1
+    digits = value[:digits_end]
+    if len(digits) < 8:
+        return None
+    
+    try:
+        timestamp = calendar.timegm((
+            int(digits[0:4]), int(digits[4:6]), int(digits[6:8]),
+            int(digits[8:10] or 0), int(digits[10:12] or 0), int(digits[12:14] or 0)
+        ))
+    except ValueError:
         return None
+    
+    offset = value[digits_end:].strip()
+    if len(offset) >= 5 and offset[0] in '+-' and offset[1:5].isdigit():
+        seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        timestamp += -seconds if offset[0] == '+' else seconds
+    return timestamp
+
+
+class ElementFilter:
+    """
+    Parse-time filter for the top-level elements of a feed (see XMLTVTarget).
+    With a channel allowlist (a set or dict of channel ids), channels and programmes of
+    other channels are rejected. Programmes entirely before window_start or starting at
+    or after window_end are rejected too. Decisions only look at the start tag's
+    attributes, and rejections are counted per tag, as is the time spent deciding.
+    """
+    
+    def __init__(self, window_start=None, window_end=None, channel_ids=None):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.channel_ids = channel_ids
+        self.rejected = {'channel': 0, 'programme': 0}
+        self.seconds = 0
+    
+    def __call__(self, tag, attrib):
+        started = time.perf_counter()
+        accepted = self.accept(tag, attrib)
+        self.seconds += time.perf_counter() - started
+        return accepted
+    
+    def accept(self, tag, attrib):
+        """Decide on an element from its start tag"""
+        if tag == 'programme':
+            if self.channel_ids is not None and attrib.get('channel') not in self.channel_ids:
+                self.rejected['programme'] += 1
+                return False
+            if not self.accept_programme(attrib):
+                self.rejected['programme'] += 1
+                return False
+        elif tag == 'channel':
+            if self.channel_ids is not None and attrib.get('id') not in self.channel_ids:
+                self.rejected['channel'] += 1
+                return False
+        return True
+    
+    def accept_programme(self, attrib):
+        """Check a programme against the time window"""
+        if self.window_start is None and self.window_end is None:
+            return True
+        
+        return self.accept_times(parse_xmltv_time(attrib.get('start')),
+                                 parse_xmltv_time(attrib.get('stop')))
+    
+    def accept_times(self, start, stop):
+        """Check parsed programme start/stop times against the time window"""
+        if start is None:
+            return True
+        if self.window_end is not None and start >= self.window_end:
+            return False
+        if self.window_start is not None and (stop if stop is not None else start) < self.window_start:
+            return False
+        return True
+
+
+class ProgrammeIndex:
+    """
+    Per-channel interval index used to deduplicate programmes across sources.
+    Sources are added in priority order. A programme is dropped when it exactly duplicates
+    a programme of the same source, or when it overlaps time already covered by a higher
+    priority source. Covered time is kept as sorted, coalesced segments per channel and
+    checked with a bisect; the programmes of the current source are kept in a set and
+    only sorted once the source ends, so deduplicating n programmes is O(n log n).
+    """
+    
+    def __init__(self):
+        # channel -> ([segment starts], [segment stops]) covered by finished sources
+        self._covered = {}
+        # channel -> {start << 32 | duration} of the current source
+        self._current = {}
+    
+    def add(self, channel, start, stop):
+        """Add a programme interval, returning False when the programme should be dropped"""
+        if start is None:
+            return True
+        if stop is None or stop <= start:
+            stop = start + 1
+        
+        covered = self._covered.get(channel)
+        if covered:
+            segment_starts, segment_stops = covered
+            i = bisect.bisect_left(segment_starts, stop) - 1
+            if i >= 0 and segment_stops[i] > start:
+                return False
+        
+        # One int per programme is much smaller than a tuple; durations fit in 32 bits
+        key = start << 32 | min(stop - start, 0xFFFFFFFF)
+        current = self._current.get(channel)
+        if current is None:
+            current = self._current[channel] = set()
+        if key in current:
+            return False
+        current.add(key)
+        return True
+    
+    def end_source(self):
+        """Fold the programmes of the current source into the covered time"""
+        for channel, keys in self._current.items():
+            intervals = [(key >> 32, (key >> 32) + (key & 0xFFFFFFFF)) for key in keys]
+            if channel in self._covered:
+                intervals.extend(zip(*self._covered[channel]))
+            intervals.sort()
+            
+            segment_starts = []
+            segment_stops = []
+            for start, stop in intervals:
+                if segment_stops and start <= segment_stops[-1]:
+                    if stop > segment_stops[-1]:
+                        segment_stops[-1] = stop
+                else:
+                    segment_starts.append(start)
+                    segment_stops.append(stop)
+            self._covered[channel] = (segment_starts, segment_stops)
+        self._current = {}
+
+
+def prepare_element(element, pretty_print=False):
+    """Lay out a top-level element for serialization"""
+    if pretty_print:
+        ET.indent(element, space="  ", level=1)
+    else:
+        # Drop the layout whitespace of the source feed
+        for child in element.iter():
+            if child.text and not child.text.strip():
+                child.text = None
+            if child.tail and not child.tail.strip():
+                child.tail = None
+    element.tail = None
+
+
+def serialize_elements(elements, pretty_print=False):
+    """
+    Serialize top-level elements to one (optionally indented) line of bytes each.
+    Most of the cost of ET.tostring() is its setup, so the elements are serialized in
+    one call under a scratch root, separated by empty comments. The parser drops
+    comments, so an element never contains one itself. ET.tostring() declares the
+    namespaces of a batch on that root, so a batch using any is serialized one element
+    at a time instead, which declares them on each element.
+    """
+    if not elements:
+        return []
+    root = ET.Element('tv')
+    for element in elements:
+        prepare_element(element, pretty_print)
+        root.append(element)
+        root.append(ET.Comment(''))
+    data = ET.tostring(root, encoding='unicode').encode('utf-8')
+    
+    prefix = b'  ' if pretty_print else b''
+    if not data.startswith(b'<tv>'):
+        return [prefix + ET.tostring(element, encoding='utf-8') + b'\n' for element in elements]
+    return [prefix + part + b'\n' for part in data[len(b'<tv>'):-len(b'<!----></tv>')].split(b'<!---->')]
+
+
+def serialize_element(element, pretty_print=False):
+    """Serialize a top-level element to one (optionally indented) line of bytes"""
+    prepare_element(element, pretty_print)
+    prefix = b'  ' if pretty_print else b''
+    return prefix + ET.tostring(element, encoding='utf-8') + b'\n'
+
+
+class XMLTVWriter:
+    """
+    Incremental XMLTV writer.
+    Elements are written to the output as they are produced, without building a tree;
+    as XMLTV requires, all channels must be written before the first programme.
+    Precompressed copies (e.g. .xml.gz) are compressed on the fly. All files are written to temporary files and
+    renamed into place once complete; their sizes and SHA-256 hashes end up in `files`.
+    When an OutputIndex or a GuideIndexWriter is given, every element written is
+    recorded in it.
+    """
+    
+    def __init__(self, path, pretty_print=False, encodings=(), index=None, guide=None):
+        self.path = Path(path)
+        self.pretty_print = pretty_print
+        self.index = index
+        self.guide = guide
+        self.channels_count = 0
+        self.programmes_count = 0
+        self.files = {}
+        # Where the programmes start in the output, once the first one is written
+        self._programmes_offset = None
+        self._outputs = []
+        try:
+            self._add_output('identity', self.path, None, None)
+            for encoding in encodings:
+                if encoding == 'gzip':
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+                    self._add_output(encoding, self.path.with_name(self.path.name + OUTPUT_ENCODINGS[encoding]),
+                                     compressor.compress, compressor.flush)
+                elif encoding == 'br' and brotli is not None:
+                    compressor = brotli.Compressor(quality=5)
+                    self._add_output(encoding, self.path.with_name(self.path.name + OUTPUT_ENCODINGS[encoding]),
+                                     compressor.process, compressor.finish)
+        except Exception:
+            self.abort()
+            raise
+        
+        self._write(
+            b"<?xml version='1.0' encoding='utf-8'?>\n"
+            b'<tv generator-info-name="EPG Merger" generator-info-url="http://localhost">\n'
+        )
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+    
+    def _add_output(self, encoding, path, compress, flush):
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        self._outputs.append({
+            'encoding': encoding,
+            'path': path,
+            'tmp_path': tmp_path,
+            'file': open(tmp_path, 'wb'),
+            'compress': compress,
+            'flush': flush,
+            'sha256': hashlib.sha256(),
+            'size': 0
+        })
+    
+    def _write_to(self, output, data):
+        output['file'].write(data)
+        output['sha256'].update(data)
+        output['size'] += len(data)
+    
+    def _write(self, data):
+        for output in self._outputs:
+            self._write_to(output, output['compress'](data) if output['compress'] else data)
+    
+    def write_channel(self, element):
+        """Write a <channel> element"""
+        self.write_elements([element])
+    
+    def write_programme(self, element):
+        """Write a <programme> element"""
+        self.write_elements([element])
+    
+    def write_elements(self, elements):
+        """Write <channel> and <programme> elements, serialized in one batch"""
+        chunk = []
+        programmes = []
+        size = 0
+        for element, data in zip(elements, serialize_elements(elements, self.pretty_print)):
+            if element.tag == 'channel':
+                self.write_raw_channel(data, element.get('id'))
+                continue
+            if self.index is not None or self.guide is not None:
+                programmes.append((element.get('channel'), parse_xmltv_time(element.get('start')),
+                                   parse_xmltv_time(element.get('stop')), size, len(data)))
+            chunk.append(data)
+            size += len(data)
+        if chunk:
+            self.write_raw_programmes(b''.join(chunk), len(chunk), programmes)
+    
+    def write_raw_channel(self, data, channel_id=None):
+        """Write a <channel> element serialized by serialize_elements()"""
+        if self._programmes_offset is not None:
+            raise ValueError("Channels must be written before the programmes")
+        if self.index is not None:
+            self.index.add_channel(channel_id, self._outputs[0]['size'], len(data), element_digest(data))
+        if self.guide is not None:
+            self.guide.add_channel(channel_id, self._outputs[0]['size'], len(data))
+        self._write(data)
+        self.channels_count += 1
+    
+    def write_raw_programmes(self, data, count, programmes=None, base=0, sources=None):
+        """
+        Write `count` <programme> elements serialized by serialize_elements().
+        With an index or a guide, `programmes` lists them as (channel id, start, stop,
+        offset, length) where offset - base is their offset in data, and `sources` gives
+        the id of the source they came from (one for all, or a list).
+        """
+        position = self._outputs[0]['size']
+        if self._programmes_offset is None:
+            self._programmes_offset = position
+        if self.guide is not None:
+            self.guide.add_programmes(data, programmes, base, position - self._programmes_offset, sources)
+        if self.index is not None:
+            add_programme = self.index.add_programme
+            shift = position - base
+            for channel_id, start, stop, offset, length in programmes:
+                relative = offset - base
+                add_programme(channel_id, start, stop, offset + shift, length,
+                              element_digest(data[relative:relative + length]))
+        self._write(data)
+        self.programmes_count += count
+    
+    def close(self):
+        """Finish the document and publish the output files"""
+        try:
+            if self._programmes_offset is None:
+                self._programmes_offset = self._outputs[0]['size']
+            self._write(b'</tv>\n')
+            
+            for output in self._outputs:
+                if output['flush']:
+                    self._write_to(output, output['flush']())
+                output['file'].close()
+            if self.index is not None:
+                self.index.size = self._outputs[0]['size']
+            for output in self._outputs:
+                os.replace(output['tmp_path'], output['path'])
+                self.files[output['encoding']] = {
+                    'size': output['size'],
+                    'sha256': output['sha256'].hexdigest(),
+                    'mtime_ns': output['path'].stat().st_mtime_ns
+                }
+            if self.guide is not None:
+                self.guide.set_output(self.files['identity'], self._programmes_offset)
+        finally:
+            self.abort()
+    
+    def abort(self):
+        """Discard any partial output"""
+        for output in self._outputs:
+            output['file'].close()
+            if output['tmp_path'].exists():
+                output['tmp_path'].unlink()
+
+
+class ProgrammeSorter:
+    """
+    External sort of programmes by channel and start time, on their way to an XMLTVWriter.
+    Programmes are buffered until memory_budget bytes; every full buffer is sorted and
+    spilled to a temporary run file, and write_to() k-way merges the runs into the
+    writer, so memory use stays bounded at any output size. Programmes with the same
+    channel and start keep the order they were added in.
+    """
+    
+    # start, stop, sequence number, channel id length, source id length, data length
+    RECORD_HEADER = struct.Struct('<qqQIII')
+    # Rough memory used by a buffered programme on top of its data
+    ENTRY_OVERHEAD = 150
+    
+    def __init__(self, memory_budget, directory):
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.runs = []
+        self._buffer = []
+        self._buffered = 0
+        self._sequence = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+    
+    def add_programmes(self, data, programmes, base=0, source_id=None):
+        """Add serialized programmes, given like XMLTVWriter.write_raw_programmes() takes them"""
+        no_time = FragmentIndex.NO_TIME
+        for channel_id, start, stop, offset, length in programmes:
+            relative = offset - base
+            # The unique sequence number keeps equal keys stable and the data uncompared.
+            # Programmes without a channel sort first, under ''
+            self._buffer.append((channel_id or '', no_time if start is None else start, self._sequence,
+                                 no_time if stop is None else stop, data[relative:relative + length], source_id))
+            self._sequence += 1
+            self._buffered += length + self.ENTRY_OVERHEAD
+        if self._buffered >= self.memory_budget:
+            self._spill()
+    
+    def _spill(self):
+        self._buffer.sort()
+        run = tempfile.TemporaryFile(dir=self.directory, buffering=STREAM_CHUNK_SIZE // 16)
+        self.runs.append(run)
+        pack = self.RECORD_HEADER.pack
+        for channel_id, start, sequence, stop, data, source_id in self._buffer:
+            channel = channel_id.encode('utf-8')
+            source = (source_id or '').encode('utf-8')
+            run.write(pack(start, stop, sequence, len(channel), len(source), len(data)))
+            run.write(channel)
+            run.write(source)
+            run.write(data)
+        self._buffer = []
+        self._buffered = 0
+    
+    def _read_run(self, run):
+        run.seek(0)
+        header_size = self.RECORD_HEADER.size
+        unpack = self.RECORD_HEADER.unpack
+        while True:
+            header = run.read(header_size)
+            if not header:
+                break
+            start, stop, sequence, channel_length, source_length, data_length = unpack(header)
+            channel_id = run.read(channel_length).decode('utf-8')
+            source_id = run.read(source_length).decode('utf-8') or None
+            yield (channel_id, start, sequence, stop, run.read(data_length), source_id)
+    
+    def write_to(self, writer):
+        """Write the programmes to the writer in order"""
+        if self.runs:
+            if self._buffer:
+                self._spill()
+            print(f"Merging {len(self.runs)} sorted runs of programmes")
+            programmes = heapq.merge(*(self._read_run(run) for run in self.runs))
+        else:
+            self._buffer.sort()
+            programmes = self._buffer
+        
+        no_time = FragmentIndex.NO_TIME
+        chunk = []
+        records = []
+        sources = []
+        size = 0
+        for channel_id, start, _, stop, data, source_id in programmes:
+            records.append((channel_id or None, None if start == no_time else start,
+                            None if stop == no_time else stop, size, len(data)))
+            sources.append(source_id)
+            chunk.append(data)
+            size += len(data)
+            if size >= STREAM_CHUNK_SIZE:
+                writer.write_raw_programmes(b''.join(chunk), len(records), records, 0, sources)
+                chunk = []
+                records = []
+                sources = []
+                size = 0
+        if records:
+            writer.write_raw_programmes(b''.join(chunk), len(records), records, 0, sources)
+        self.close()
+    
+    def close(self):
+        """Discard the buffered programmes and the run files"""
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self._buffer = []
+        self._buffered = 0
+
+
+def get_fragment_variant(channel_map, pretty_print, past_days):
+    """Get a short key for the settings that change how a source is serialized"""
+    settings = json.dumps([channel_map, bool(pretty_print), past_days], sort_keys=True)
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]
+
+
+class FragmentIndex:
+    """
+    Compact index of a source fragment (see build_source_fragment).
+    Channels are few and kept as (id, offset, length) tuples. Programmes are kept as
+    parallel typed arrays of channel number, start, stop, offset and length, 32
+    bytes per programme instead of a Python object per field. Channel ids are stored
+    once in channel_ids and missing times as NO_TIME. On disk the index is a JSON
+    header line followed by the raw arrays, so loading it is a few bulk reads.
+    """
+    
+    __slots__ = ('channels', 'channel_ids', 'channel_numbers', 'programme_channels', 'starts', 'stops',
+                 'offsets', 'lengths', 'size', 'rejected', 'error', 'timings')
+    
+    NO_TIME = -2 ** 63
+    COLUMNS = ('programme_channels', 'starts', 'stops', 'offsets', 'lengths')
+    
+    def __init__(self):
+        self.channels = []
+        self.channel_ids = []
+        self.channel_numbers = {}
+        self.programme_channels = array('I')
+        self.starts = array('q')
+        self.stops = array('q')
+        self.offsets = array('q')
+        self.lengths = array('I')
+        self.size = 0
+        self.rejected = {'channel': 0, 'programme': 0}
+        self.error = None
+        self.timings = {}
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def add_channel(self, channel_id, offset, length):
+        self.channels.append((channel_id, offset, length))
+    
+    def add_programme(self, channel_id, start, stop, offset, length):
+        number = self.channel_numbers.get(channel_id)
+        if number is None:
+            number = self.channel_numbers[channel_id] = len(self.channel_ids)
+            self.channel_ids.append(channel_id)
+        self.programme_channels.append(number)
+        self.starts.append(self.NO_TIME if start is None else start)
+        self.stops.append(self.NO_TIME if stop is None else stop)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+    
+    def iter_programmes(self):
+        """Iterate over the programmes as (channel id, start, stop, offset, length)"""
+        no_time = self.NO_TIME
+        channel_ids = self.channel_ids
+        for number, start, stop, offset, length in zip(self.programme_channels, self.starts, self.stops,
+                                                        self.offsets, self.lengths):
+            yield (channel_ids[number],
+                   None if start == no_time else start,
+                   None if stop == no_time else stop,
+                   offset,
+                   length)
+    
+    def to_bytes(self):
+        header = {
+            'channels': self.channels,
+            'channel_ids': self.channel_ids,
+            'programmes': len(self),
+            'size': self.size,
+            'rejected': self.rejected,
+            'error': self.error,
+            'timings': self.timings
+        }
+        parts = [json.dumps(header, separators=(',', ':')).encode('utf-8'), b'\n']
+        parts.extend(getattr(self, column).tobytes() for column in self.COLUMNS)
+        return b''.join(parts)
+    
+    @classmethod
+    def from_file(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            for column in cls.COLUMNS:
+                values = getattr(index, column)
+                values.fromfile(f, header['programmes'])
+        index.channels = [tuple(channel) for channel in header['channels']]
+        index.channel_ids = header['channel_ids']
+        index.size = header['size']
+        index.rejected = header['rejected']
+        index.error = header['error']
+        index.timings = header['timings']
+        return index
+
+
+def element_digest(data):
+    """Get a 64-bit checksum of a serialized element (CRC-32 and Adler-32, cheap to compute)"""
+    return zlib.crc32(data) << 32 | zlib.adler32(data)
+
+
+class OutputIndex(FragmentIndex):
+    """
+    Index of a published output version (see publish_epg_version): offsets point into
+    the output, and every channel and programme carries a hash of its serialized form
+    (see element_digest) so versions can be compared without reading them.
+    Channels are kept as (id, offset, length, hash) tuples.
+    """
+    
+    __slots__ = ('hashes',)
+    
+    COLUMNS = FragmentIndex.COLUMNS + ('hashes',)
+    
+    def __init__(self):
+        super().__init__()
+        self.hashes = array('Q')
+    
+    def add_channel(self, channel_id, offset, length, digest=0):
+        self.channels.append((channel_id, offset, length, digest))
+    
+    def add_programme(self, channel_id, start, stop, offset, length, digest=0):
+        super().add_programme(channel_id, start, stop, offset, length)
+        self.hashes.append(digest)
+
+
+def build_source_fragment(payload_path, data_path, channel_map=None, pretty_print=False, window_start=None):
+    """
+    Serialize the channels and programmes of a source payload into a fragment file.
+    Elements are filtered and renamed by the channel map and written in feed order.
+    Returns the FragmentIndex with the location of every element and the seconds spent
+    per stage.
+    Programmes that ended before window_start stay out of the fragment; the rest of
+    the time window depends on the time of the merge and is applied by the merge.
+    """
+    element_filter = ElementFilter(window_start, None, channel_map)
+    index = FragmentIndex()
+    timings = {'decompress': 0, 'parse': 0, 'write': 0}
+    offset = 0
+    batch = []
+    
+    tmp_path = data_path.with_name(f".{data_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            # Elements are serialized and written in batches (see serialize_elements)
+            def flush_batch():
+                nonlocal offset
+                started = time.perf_counter()
+                serialized = serialize_elements(batch, pretty_print)
+                for element, data in zip(batch, serialized):
+                    if element.tag == 'channel':
+                        index.add_channel(element.get('id'), offset, len(data))
+                    else:
+                        index.add_programme(
+                            element.get('channel'),
+                            parse_xmltv_time(element.get('start')),
+                            parse_xmltv_time(element.get('stop')),
+                            offset,
+                            len(data)
+                        )
+                    offset += len(data)
+                f.write(b''.join(serialized))
+                batch.clear()
+                timings['write'] += time.perf_counter() - started
+            
+            try:
+                for element in iter_xmltv_elements(payload_path, element_filter, timings):
+                    if element.tag == 'channel':
+                        channel_id = element.get('id')
+                        if channel_map is not None:
+                            channel_id = channel_map[channel_id]
+                            element.set('id', channel_id)
+                        if not channel_id:
+                            continue
+                    elif element.tag == 'programme':
+                        if channel_map is not None:
+                            element.set('channel', channel_map[element.get('channel')])
+                    else:
+                        continue
+                    batch.append(element)
+                    if len(batch) >= SERIALIZE_BATCH_SIZE:
+                        flush_batch()
+            except (ET.ParseError, zlib.error) as e:
+                # The same payload always fails the same way, so keep what was parsed
+                index.error = str(e)
+            flush_batch()
+        os.replace(tmp_path, data_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    
+    # The filter runs inside the parser
+    timings['parse'] -= element_filter.seconds
+    timings['filter'] = element_filter.seconds
+    
+    index.size = offset
+    index.rejected = element_filter.rejected
+    index.timings = timings
+    return index
+
+
+def get_fragment_paths(source_id, payload_path, channel_map=None, pretty_print=False, past_days=None):
+    """
+    Get the variant key and the data and index paths of the fragment of a source payload.
+    Fragments are keyed by the SHA-256 of the payload and the serialization settings.
+    """
+    variant = get_fragment_variant(channel_map, pretty_print, past_days)
+    content_hash = get_payload_sha256(source_id, payload_path)
+    base = f"{variant}.{content_hash[:32]}"
+    fragment_dir = FRAGMENTS_DIR / source_id
+    return variant, fragment_dir / f"{base}.xml", fragment_dir / f"{base}.idx"
+
+
+def load_source_fragment(data_path, index_path):
+    """Load the index of a stored fragment, or None when it has to be built"""
+    if not index_path.exists() or not data_path.exists():
+        return None
+    try:
+        index = FragmentIndex.from_file(index_path)
+        if index.size != data_path.stat().st_size:
+            return None
+        # Mark the fragment as used
+        os.utime(index_path)
+        return index
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+
+def save_source_fragment(variant, data_path, index_path, index):
+    """Store the index of a built fragment and remove the fragments of previous payloads"""
+    write_bytes_atomic(index_path, index.to_bytes())
+    for path in index_path.parent.glob(f"{variant}.*"):
+        if path.name not in (data_path.name, index_path.name) and not path.name.startswith('.'):
+            path.unlink(missing_ok=True)
+
+
+def get_parse_pool_context():
+    """
+    Get the multiprocessing context for parse workers. Forking a worker process that
+    runs threads can deadlock the child, so workers are started by a single-threaded
+    fork server that has the app imported, or spawned where there is none.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def get_source_fragments(sources, payload_paths, channel_map=None, pretty_print=False, past_days=None,
+                         now=None, parse_workers=DEFAULT_PARSE_WORKERS):
+    """
+    Get the fragments of the sources of a merge in source order, as (data_path, index, reused).
+    A fragment is only built when the payload or the settings changed since the last merge;
+    otherwise the stored one is reused. With more than one parse worker, fragments are built
+    in parallel by worker processes, which write the fragment file and only send back its
+    index. Sources without a payload or whose fragment could not be built get None.
+    """
+    fragments = [None] * len(sources)
+    window_start = (now or time.time()) - float(past_days) * 86400 if past_days is not None else None
+    
+    builds = []
+    for i, (source, payload_path) in enumerate(zip(sources, payload_paths)):
+        if payload_path is None:
+            continue
+        try:
+            variant, data_path, index_path = get_fragment_paths(
+                source.get('id'), payload_path, channel_map, pretty_print, past_days)
+        except OSError as e:
+            print(f"Error parsing {source.get('url')}: {str(e)}")
+            inc_metric('epg_source_failures_total', source=source.get('id'), stage='parse')
+            continue
+        
+        index = load_source_fragment(data_path, index_path)
+        if index is not None:
+            fragments[i] = (data_path, index, True)
+            inc_metric('epg_fragments_total', source=source.get('id'), result='reused')
+        else:
+            data_path.parent.mkdir(exist_ok=True)
+            builds.append((i, source, payload_path, variant, data_path, index_path))
+    
+    if not builds:
+        return fragments
+    
+    def finish_build(build, get_index):
+        i, source, payload_path, variant, data_path, index_path = build
+        try:
+            index = get_index()
+            save_source_fragment(variant, data_path, index_path, index)
+            fragments[i] = (data_path, index, False)
+            inc_metric('epg_fragments_total', source=source.get('id'), result='built')
+            for stage, seconds in index.timings.items():
+                observe_metric('epg_stage_duration_seconds', seconds, stage=stage, source=source.get('id'))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Error parsing {source.get('url')}: {str(e)}")
+            inc_metric('epg_source_failures_total', source=source.get('id'), stage='parse')
+            update_job_status(current_step=f"Failed to parse data from {source.get('name', 'Unnamed Source')}")
+    
+    workers = min(parse_workers, len(builds))
+    context = get_parse_pool_context() if workers > 1 else None
+    if context is None:
+        for build in builds:
+            update_job_status(current_step=f"Parsing data from {build[1].get('name', 'Unnamed Source')}")
+            finish_build(build, lambda: build_source_fragment(
+                build[2], build[4], channel_map, pretty_print, window_start))
+        return fragments
+    
+    update_job_status(current_step=f"Parsing data from {len(builds)} sources in {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(build_source_fragment, build[2], build[4], channel_map, pretty_print, window_start)
+                   for build in builds]
+        for build, future in zip(builds, futures):
+            finish_build(build, future.result)
+    
+    return fragments
+
+
+def prune_source_fragments():
+    """Remove the fragments that no merge used for FRAGMENT_MAX_AGE"""
+    cutoff = time.time() - FRAGMENT_MAX_AGE
+    for index_path in FRAGMENTS_DIR.glob('*/*.idx'):
+        try:
+            if index_path.stat().st_mtime < cutoff:
+                index_path.unlink()
+                index_path.with_suffix('.xml').unlink(missing_ok=True)
+        except OSError:
+            continue
+
+
+class GuideIndexWriter:
+    """
+    Builds the SQLite guide index of a merged output ({id}.db) next to it, fed by the
+    XMLTVWriter of the output. Channels and programmes are stored as offsets into the
+    output, keyed on (channel, start), and the programme texts are indexed in a
+    contentless FTS5 table, so the guide API answers small questions by reading only
+    the elements it returns. The database is written to a temporary file and renamed
+    into place on close().
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
+        self._db = sqlite3.connect(self.tmp_path)
+        self._db.executescript(f"""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA user_version = {GUIDE_SCHEMA_VERSION};
+            CREATE TABLE output (size INTEGER, mtime_ns INTEGER, programmes_offset INTEGER);
+            CREATE TABLE channels (id TEXT PRIMARY KEY, offset INTEGER NOT NULL, length INTEGER NOT NULL);
+            CREATE TABLE programmes (
+                id INTEGER PRIMARY KEY,
+                channel TEXT,
+                start INTEGER,
+                stop INTEGER,
+                source TEXT,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE VIRTUAL TABLE programmes_search USING fts5(text, content='', detail='none');
+        """)
+        self._next_id = 1
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+    
+    def add_channel(self, channel_id, offset, length):
+        self._db.execute("INSERT OR IGNORE INTO channels VALUES (?, ?, ?)", (channel_id, offset, length))
+    
+    def add_programmes(self, data, programmes, base, position, sources):
+        """
+        Add programmes as passed to XMLTVWriter.write_raw_programmes(), written at
+        `position` of the programmes. Programmes without a channel cannot be looked up
+        and are left out.
+        """
+        rows = []
+        texts = []
+        next_id = self._next_id
+        for number, (channel_id, start, stop, offset, length) in enumerate(programmes):
+            if channel_id is None:
+                continue
+            relative = offset - base
+            text = b' '.join(GUIDE_TEXT_PATTERN.findall(data, relative, relative + length)).decode('utf-8')
+            if '&' in text:
+                text = html.unescape(text)
+            source_id = sources if sources is None or isinstance(sources, str) else sources[number]
+            rows.append((next_id, channel_id, start, stop, source_id, position + relative, length))
+            texts.append((next_id, text))
+            next_id += 1
+        self._next_id = next_id
+        self._db.executemany("INSERT INTO programmes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._db.executemany("INSERT INTO programmes_search (rowid, text) VALUES (?, ?)", texts)
+    
+    def set_output(self, info, programmes_offset):
+        """Record the published output: its identity file info and where its programmes start"""
+        self._db.execute("INSERT INTO output VALUES (?, ?, ?)", (info['size'], info['mtime_ns'], programmes_offset))
+    
+    def close(self):
+        """Index the programmes and publish the database"""
+        try:
+            # Building the index after the inserts is much faster than maintaining it
+            self._db.execute("CREATE INDEX programmes_channel_start ON programmes (channel, start)")
+            self._db.execute("CREATE INDEX programmes_start ON programmes (start)")
+            self._db.commit()
+            self._db.close()
+            os.replace(self.tmp_path, self.path)
+        finally:
+            self.abort()
+    
+    def abort(self):
+        """Discard a partial database"""
+        self._db.close()
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
+
+
+class GuideIndexReader:
+    """
+    Read-only access to the guide index of a merged output and the output it points
+    into. Opened with open_guide_index(), which checks that they belong together.
+    """
+    
+    def __init__(self, db, output, programmes_offset):
+        self.db = db
+        self.output = output
+        self.programmes_offset = programmes_offset
+    
+    def execute(self, sql, params=()):
+        return self.db.execute(sql, params)
+    
+    def read_channel(self, row):
+        """Parse the <channel> of a channel row"""
+        self.output.seek(row['offset'])
+        return ET.fromstring(self.output.read(row['length']))
+    
+    def read_programme(self, row):
+        """Parse the <programme> of a programme row"""
+        self.output.seek(self.programmes_offset + row['offset'])
+        return ET.fromstring(self.output.read(row['length']))
+    
+    def close(self):
+        self.db.close()
+        self.output.close()
+
+
+def load_logo_index():
+    """Load the logo index: upstream URL -> {hash, checked_at, used_at}"""
+    try:
+        with open(LOGO_INDEX_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def fetch_logo(url):
+    """Download a logo into the content-addressed logo cache, returning its hash or None"""
+    try:
+        with requests.get(url, timeout=15, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            if not content_type.startswith('image/'):
+                raise ValueError(f"not an image ({content_type or 'no content type'})")
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > LOGO_MAX_SIZE:
+                    raise ValueError(f"larger than {LOGO_MAX_SIZE} bytes")
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error fetching logo {url}: {str(e)}")
+        inc_metric('epg_logo_fetches_total', result='failed')
+        return None
+    
+    data = b''.join(chunks)
+    digest = hashlib.sha256(data).hexdigest()
+    if not (LOGOS_DIR / digest).exists():
+        write_bytes_atomic(LOGOS_DIR / digest, data)
+        write_bytes_atomic(LOGOS_DIR / f"{digest}.json",
+                           json.dumps({'content_type': content_type, 'size': size}).encode('utf-8'))
+    inc_metric('epg_logo_fetches_total', result='downloaded')
+    inc_metric('epg_logo_download_bytes_total', size)
+    return digest
+
+
+def prefetch_logos(urls, config):
+    """
+    Make sure the logos at the given URLs are cached, downloading the missing and stale
+    ones concurrently (bounded like source downloads). A logo that cannot be downloaded
+    again keeps its cached copy. Returns a mapping of URL to hash for the cached logos.
+    """
+    now = time.time()
+    with logos_lock:
+        index = load_logo_index()
+    
+    def is_stale(url):
+        entry = index.get(url)
+        if entry is None:
+            return True
+        return now - entry['checked_at'] > (LOGO_REFRESH_AGE if entry['hash'] else LOGO_RETRY_AGE)
+    
+    pending = [url for url in urls if is_stale(url)]
+    if pending:
+        update_job_status(current_step=f"Fetching {len(pending)} channel logos")
+        print(f"Fetching {len(pending)} channel logos")
+        max_workers = max(1, int(config.get('fetch_concurrency', DEFAULT_FETCH_CONCURRENCY)))
+        per_host_limit = max(1, int(config.get('fetch_per_host_limit', DEFAULT_FETCH_PER_HOST_LIMIT)))
+        
+        digests = map_per_host(fetch_logo, pending, pending, max_workers, per_host_limit)
+    else:
+        digests = []
+    
+    with logos_lock:
+        index = load_logo_index()
+        for url, digest in zip(pending, digests):
+            previous = index.get(url, {})
+            index[url] = {'hash': digest or previous.get('hash'), 'checked_at': now}
+        for url in urls:
+            index.setdefault(url, {'hash': None, 'checked_at': now})['used_at'] = now
+        write_bytes_atomic(LOGO_INDEX_FILE, json.dumps(index).encode('utf-8'))
+    
+    return {url: index[url]['hash'] for url in urls if index[url]['hash']}
+
+
+def prune_logo_cache():
+    """Forget the logos that no merge used for LOGO_MAX_AGE and remove unreferenced files"""
+    cutoff = time.time() - LOGO_MAX_AGE
+    with logos_lock:
+        index = load_logo_index()
+        kept = {url: entry for url, entry in index.items() if entry.get('used_at', 0) >= cutoff}
+        if len(kept) != len(index):
+            write_bytes_atomic(LOGO_INDEX_FILE, json.dumps(kept).encode('utf-8'))
+        used = {entry['hash'] for entry in kept.values() if entry['hash']}
+        for meta_path in LOGOS_DIR.glob('*.json'):
+            digest = meta_path.name[:-len('.json')]
+            if meta_path != LOGO_INDEX_FILE and digest not in used:
+                (LOGOS_DIR / digest).unlink(missing_ok=True)
+                meta_path.unlink(missing_ok=True)
+
+
+def collect_channel_icons(fragments):
+    """Get the http(s) icon URLs of the channels in source fragments"""
+    urls = {}
+    for fragment_entry in fragments:
+        if fragment_entry is None:
+            continue
+        fragment_path, fragment, _ = fragment_entry
+        try:
+            with open(fragment_path, 'rb') as f:
+                for _, offset, length in fragment.channels:
+                    f.seek(offset)
+                    for match in CHANNEL_ICON_PATTERN.finditer(f.read(length)):
+                        url = html.unescape(match.group(2).decode('utf-8'))
+                        if url.startswith(('http://', 'https://')):
+                            urls[url] = None
+        except OSError:
+            continue
+    return list(urls)
+
+
+def rewrite_channel_icons(data, logo_hashes, base_url):
+    """Point the icons of a serialized <channel> to the cached logos"""
+    def replace(match):
+        digest = logo_hashes.get(html.unescape(match.group(2).decode('utf-8')))
+        if digest is None:
+            return match.group(0)
+        return match.group(1) + f"{base_url}/logos/{digest}".encode('utf-8') + match.group(3)
+    
+    return CHANNEL_ICON_PATTERN.sub(replace, data)
+
+
+def map_per_host(func, items, urls, max_workers, per_host_limit):
+    """
+    Run func on every item on up to max_workers threads, with at most per_host_limit of
+    them against the host of the item's URL at a time. Items of a busy host wait in a
+    queue for that host instead of holding a thread, so other hosts keep going.
+    Returns the results in the order of the items.
+    """
+    queues = OrderedDict()
+    for i, url in enumerate(urls):
+        queues.setdefault(urlparse(url or '').netloc.lower(), deque()).append(i)
+    active = dict.fromkeys(queues, 0)
+    results = [None] * len(items)
+    running = {}
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        while queues or running:
+            # Start items of the hosts below their limit, taking turns between hosts
+            started = True
+            while started and len(running) < max_workers:
+                started = False
+                for host in list(queues):
+                    if len(running) >= max_workers:
+                        break
+                    if active[host] >= per_host_limit:
+                        continue
+                    i = queues[host].popleft()
+                    if not queues[host]:
+                        del queues[host]
+                    active[host] += 1
+                    running[executor.submit(func, items[i])] = (i, host)
+                    started = True
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, host = running.pop(future)
+                active[host] -= 1
+                results[i] = future.result()
+    
+    return results
+
+
+def fetch_sources(sources, config, source_cache=None):
+    """
+    Fetch several sources concurrently.
+    Downloads are bounded by a global and a per-host limit (see map_per_host). The payload
+    paths are returned in the same order as the given sources (None for failures).
+    Sources already present in source_cache are reused instead of downloaded.
+    """
+    if source_cache is None:
+        source_cache = {}
+    
+    pending = [s for s in sources if s.get('id') not in source_cache]
+    if pending:
+        max_workers = max(1, int(config.get('fetch_concurrency', DEFAULT_FETCH_CONCURRENCY)))
+        per_host_limit = max(1, int(config.get('fetch_per_host_limit', DEFAULT_FETCH_PER_HOST_LIMIT)))
+        
+        def fetch_one(source):
+            url = source.get('url')
+            source_name = source.get('name', 'Unnamed Source')
+            
+            update_job_status(
+                current_source=source_name,
+                current_step=f"Downloading from {source_name}"
+            )
+            print(f"Fetching from {url}")
+            
+            def report_progress(downloaded, total):
+                update_source_progress(source.get('id'), source_name, downloaded, total)
+            
+            download_started = time.perf_counter()
+            payload_path = fetch_source(url, source.get('id'), report_progress)
+            observe_metric('epg_stage_duration_seconds', time.perf_counter() - download_started,
+                           stage='download', source=source.get('id'))
+            update_source_progress(source.get('id'), source_name, done=True)
+            
+            if payload_path is None:
+                update_job_status(current_step=f"Failed to fetch from {source_name}")
+            else:
+                update_job_status(current_step=f"Downloaded data from {source_name}")
+            increment_sources_completed()
+            return payload_path
+        
+        payload_paths = map_per_host(fetch_one, pending, [s.get('url') for s in pending], max_workers, per_host_limit)
+        for source, payload_path in zip(pending, payload_paths):
+            source_cache[source.get('id')] = payload_path
+            if payload_path is not None:
+                # Update the last_fetched timestamp for this source
+                update_source_last_fetched(source.get('id'))
+    
+    # Sources reused from the cache count as completed straight away
+    for _ in range(len(sources) - len(pending)):
+        increment_sources_completed()
+    
+    return [source_cache.get(s.get('id')) for s in sources]
 
 
 def update_source_last_fetched(source_id):
-    """Update the last_fetched timestamp for a source"""
-    config = load_config()
-    sources = config.get('sources', [])
+    """Record the last_fetched timestamp for a source (saved by flush_source_last_fetched)"""
+    with pending_last_fetched_lock:
+        pending_last_fetched[source_id] = datetime.now().isoformat()
+
+
+def flush_source_last_fetched():
+    """Save all recorded last_fetched timestamps to the config in a single write"""
+    with pending_last_fetched_lock:
+        timestamps = dict(pending_last_fetched)
+        pending_last_fetched.clear()
     
-    for source in sources:
-        if source.get('id') == source_id:
-            source['last_fetched'] = datetime.now().isoformat()
-            break
+    if not timestamps:
+        return
+    
+    def apply(config):
+        for source in config.get('sources', []):
+            if source.get('id') in timestamps:
+                source['last_fetched'] = timestamps[source.get('id')]
+    
+    update_config(apply)
+
+
+def job_changed():
+    """Wake up the job status streams; the caller must hold jobs_lock"""
+    job_events['version'] += 1
+    jobs_changed.notify_all()
+
+
+def publish_jobs(force=False):
+    """
+    Write the job history of this process to data/jobs/<pid>.json for the other workers.
+    Writes are throttled; a delayed write picks up changes made in between.
+    """
+    with jobs_lock:
+        now = time.time()
+        if not force and now - job_events['published_at'] < JOB_PUBLISH_INTERVAL:
+            if job_events['publish_timer'] is None:
+                timer = threading.Timer(JOB_PUBLISH_INTERVAL, publish_jobs, kwargs={'force': True})
+                timer.daemon = True
+                job_events['publish_timer'] = timer
+                timer.start()
+            return
+        job_events['published_at'] = now
+        if job_events['publish_timer'] is not None:
+            job_events['publish_timer'].cancel()
+            job_events['publish_timer'] = None
+    
+    with jobs_publish_lock:
+        with jobs_lock:
+            snapshot = [format_job(job) for job in jobs.values()]
+        data = json.dumps({'pid': os.getpid(), 'start_token': get_process_start_token(os.getpid()),
+                           'jobs': snapshot}).encode('utf-8')
+        write_bytes_atomic(JOBS_DIR / f"{os.getpid()}.json", data)
+
+
+def get_process_start_token(pid):
+    """
+    Identify a process by its boot and its start time, so a reused pid is told apart.
+    Returns None where /proc is not available.
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+            boot_id = f.read().strip()
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            # The command name may contain spaces; starttime is the 22nd field
+            start_time = f.read().rsplit(b')', 1)[1].split()[19].decode()
+    except (OSError, IndexError):
+        return None
+    return f"{boot_id}:{start_time}"
+
+
+def read_process_snapshots(directory, cache):
+    """
+    Read the JSON snapshots published as <pid>.json by the other live worker processes.
+    Snapshots of processes that are gone, including those whose pid was reused by a
+    new process, are removed. Reads are cached by mtime.
+    """
+    if os.name != 'posix':
+        return []
+    
+    snapshots = []
+    for path in directory.glob('*.json'):
+        try:
+            pid = int(path.stem)
+        except ValueError:
+            continue
+        if pid == os.getpid():
+            continue
+        
+        try:
+            os.kill(pid, 0)
+            alive = True
+        except ProcessLookupError:
+            alive = False
+        except PermissionError:
+            alive = True
+        
+        snapshot = None
+        if alive:
+            try:
+                mtime = path.stat().st_mtime_ns
+                cached = cache.get(path)
+                if cached is None or cached[0] != mtime:
+                    with open(path, 'r') as f:
+                        cached = (mtime, json.load(f))
+                    cache[path] = cached
+                snapshot = cached[1]
+            except (OSError, ValueError):
+                continue
+            start_token = snapshot.get('start_token')
+            if start_token is not None and start_token != get_process_start_token(pid):
+                alive = False
+        
+        if not alive:
+            # The process is gone, and so is its snapshot
+            path.unlink(missing_ok=True)
+            cache.pop(path, None)
+            continue
+        snapshots.append(snapshot)
     
-    config['sources'] = sources
-    save_config(config)
+    return snapshots
+
+
+def read_other_process_jobs():
+    """Read the job histories published by the other live worker processes"""
+    other_jobs = []
+    for snapshot in read_process_snapshots(JOBS_DIR, other_jobs_cache):
+        other_jobs.extend(snapshot.get('jobs', []))
+    return other_jobs
 
 
 def update_job_status(**kwargs):
-    """Update job status with thread safety"""
-    with job_status_lock:
+    """Update the status of the running job with thread safety"""
+    with jobs_lock:
+        job = jobs.get(current_job_id)
+        if job is None:
+            return
+        changed = False
         for key, value in kwargs.items():
-            if key in job_status:
-                job_status[key] = value
+            if key in job and job[key] != value:
+                job[key] = value
+                changed = True
+        if not changed:
+            return
+        job_changed()
+    publish_jobs()
+
+
+def increment_sources_completed():
+    """Increment the completed sources counter of the running job with thread safety"""
+    with jobs_lock:
+        job = jobs.get(current_job_id)
+        if job is None:
+            return
+        job['sources_completed'] += 1
+        job_changed()
+    publish_jobs()
+
+
+def update_source_progress(source_id, source_name, downloaded=None, total=None, done=False):
+    """Record the download progress (in bytes) of a source for the running job"""
+    with jobs_lock:
+        job = jobs.get(current_job_id)
+        if job is None:
+            return
+        progress = job['source_progress'].setdefault(source_id, {
+            'name': source_name,
+            'bytes': 0,
+            'total': None,
+            'done': False
+        })
+        if downloaded is not None:
+            progress['bytes'] = downloaded
+        if total is not None:
+            progress['total'] = total
+        progress['done'] = done
+        job_changed()
+    publish_jobs()
+
+
+def format_job(job):
+    """Add the derived progress fields to a copy of a job record"""
+    status = dict(job)
+    status['source_progress'] = {source_id: dict(progress)
+                                 for source_id, progress in job.get('source_progress', {}).items()}
+    status['is_running'] = job['status'] in ('queued', 'running')
+    
+    # Calculate progress percentage
+    if status['total_steps'] > 0:
+        status['progress_percentage'] = int((status['progress'] / status['total_steps']) * 100)
+    else:
+        status['progress_percentage'] = 0
+    
+    # Calculate elapsed time
+    if status['start_time']:
+        start_time = datetime.fromisoformat(status['start_time'])
+        if status['end_time']:
+            end_time = datetime.fromisoformat(status['end_time'])
+        else:
+            end_time = datetime.now()
+        status['elapsed_time'] = str(end_time - start_time)
+        status['elapsed_seconds'] = round((end_time - start_time).total_seconds(), 1)
+    else:
+        status['elapsed_time'] = None
+        status['elapsed_seconds'] = None
+    
+    return status
+
+
+def get_job(job_id):
+    """Get a job by id, including jobs of other worker processes"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            return format_job(job)
+    
+    for job in read_other_process_jobs():
+        if job['id'] == job_id:
+            return format_job(job)
+    return None
+
+
+def get_jobs():
+    """Get the job history of all worker processes, newest first"""
+    with jobs_lock:
+        all_jobs = [format_job(job) for job in jobs.values()]
+    all_jobs.extend(format_job(job) for job in read_other_process_jobs())
+    return sorted(all_jobs, key=lambda job: job['created_at'], reverse=True)
 
 
 def get_job_status():
-    """Get current job status"""
-    with job_status_lock:
-        return job_status.copy()
+    """Get the status of the running job (in any worker), or of the most recent job when idle"""
+    with jobs_lock:
+        job = jobs.get(current_job_id)
+        if job is not None:
+            return format_job(job)
+        all_jobs = list(jobs.values())
+    all_jobs.extend(read_other_process_jobs())
+    
+    if all_jobs:
+        running = [job for job in all_jobs if job['status'] == 'running']
+        job = running[0] if running else max(all_jobs, key=lambda job: job['created_at'])
+        return format_job(job)
+    
+    return {
+        'id': None,
+        'status': 'idle',
+        'is_running': False,
+        'current_step': '',
+        'progress': 0,
+        'total_steps': 0,
+        'progress_percentage': 0,
+        'current_epg_file': '',
+        'current_source': '',
+        'sources_completed': 0,
+        'total_sources': 0,
+        'source_progress': {},
+        'start_time': None,
+        'end_time': None,
+        'elapsed_time': None,
+        'elapsed_seconds': None,
+        'error': None
+    }
+
+
+def submit_merge_job(job_type, epg_file_id=None, trigger='manual', source_id=None):
+    """
+    Queue a merge job to run in the background: 'all', 'epg_file' (epg_file_id) or
+    'source' (refresh source_id and merge the EPG files that include it).
+    When an identical job is already queued or running, in this or another worker,
+    that job is returned instead. Returns (job, created).
+    """
+    import uuid
+    if job_type == 'all':
+        key = job_type
+    elif job_type == 'source':
+        key = f"{job_type}:{source_id}"
+    else:
+        key = f"{job_type}:{epg_file_id}"
+    
+    for job in read_other_process_jobs():
+        if job.get('key') == key and job['status'] in ('queued', 'running'):
+            return format_job(job), False
+    
+    with jobs_lock:
+        for job in jobs.values():
+            if job['key'] == key and job['status'] in ('queued', 'running'):
+                return format_job(job), False
+        
+        job = {
+            'id': str(uuid.uuid4()),
+            'key': key,
+            'type': job_type,
+            'epg_file_id': epg_file_id,
+            'source_id': source_id,
+            'trigger': trigger,
+            'status': 'queued',
+            'created_at': datetime.now().isoformat(),
+            'start_time': None,
+            'end_time': None,
+            'error': None,
+            'current_step': 'Waiting for other jobs to finish',
+            'progress': 0,
+            'total_steps': 0,
+            'current_epg_file': '',
+            'current_source': '',
+            'sources_completed': 0,
+            'total_sources': 0,
+            'source_progress': {}
+        }
+        jobs[job['id']] = job
+        
+        # Forget the oldest finished jobs
+        finished = [j['id'] for j in jobs.values() if j['status'] not in ('queued', 'running')]
+        for job_id in finished[:max(0, len(jobs) - JOB_HISTORY_LIMIT)]:
+            del jobs[job_id]
+        
+        job_changed()
+        queued = format_job(job)
+    
+    publish_jobs(force=True)
+    job_executor.submit(run_merge_job, job['id'])
+    return queued, True
 
 
-def merge_epg_file(epg_file_id):
+def execute_merge_job(job_type, epg_file_id, source_id=None, trigger='manual'):
+    """Run the merge of a job, returning (success, error)"""
+    try:
+        if job_type == 'all':
+            # Scheduled merges leave sources with their own refresh interval alone
+            return merge_all_epg_files(reuse_scheduled_sources=trigger == 'schedule'), None
+        if job_type == 'source':
+            return merge_source_epg_files(source_id), None
+        
+        update_job_status(
+            current_step=f"Starting merge for EPG file {epg_file_id}",
+            total_steps=1
+        )
+        success = merge_epg_file(epg_file_id)
+        update_job_status(progress=1)
+        return success, None
+    except Exception as e:
+        print(f"Merge job failed: {str(e)}")
+        return False, str(e)
+
+
+def run_merge_job(job_id):
+    """
+    Run a queued merge job and record its outcome.
+    The merge lock file keeps jobs of different worker processes from running at once.
+    """
+    global current_job_id
+    
+    with jobs_lock:
+        job = jobs[job_id]
+        job['status'] = 'running'
+        job['start_time'] = datetime.now().isoformat()
+        job['current_step'] = 'Starting EPG merge job'
+        job_type = job['type']
+        epg_file_id = job['epg_file_id']
+        source_id = job.get('source_id')
+        trigger = job['trigger']
+        current_job_id = job_id
+        job_changed()
+    publish_jobs(force=True)
+    
+    with file_lock(MERGE_LOCK_FILE, blocking=False) as acquired:
+        if acquired:
+            success, error = execute_merge_job(job_type, epg_file_id, source_id, trigger)
+    if not acquired:
+        update_job_status(current_step="Waiting for a merge in another process to finish")
+        with file_lock(MERGE_LOCK_FILE):
+            success, error = execute_merge_job(job_type, epg_file_id, source_id, trigger)
+    
+    with jobs_lock:
+        job['status'] = 'completed' if success else 'failed'
+        job['end_time'] = datetime.now().isoformat()
+        if not success:
+            job['error'] = error or job['error'] or 'EPG merge failed'
+        current_job_id = None
+        job_changed()
+    publish_jobs(force=True)
+
+
+def run_scheduled_merge():
+    """Queue the scheduled merge of all EPG files"""
+    submit_merge_job('all', trigger='schedule')
+
+
+def run_scheduled_source_refresh(source_id):
+    """Queue the scheduled refresh of a source with its own refresh interval"""
+    submit_merge_job('source', trigger='schedule', source_id=source_id)
+
+
+def get_epg_setting(config, epg_file, key, default):
+    """Get a setting of an EPG file, falling back to the global config value"""
+    return epg_file.get(key, config.get(key, default))
+
+
+def get_channel_map(epg_file):
+    """
+    Get the channel allowlist of an EPG file as a dict of source id -> output id.
+    The 'channels' setting is either a list of ids or a mapping used to rename ids
+    (a null target keeps the id). Returns None when all channels are kept.
+    """
+    channels = epg_file.get('channels')
+    if channels is None:
+        return None
+    if isinstance(channels, dict):
+        return {channel_id: target or channel_id for channel_id, target in channels.items()}
+    return {channel_id: channel_id for channel_id in channels}
+
+
+def merge_epg_file(epg_file_id, source_cache=None):
     """
     Merge EPG XML files for a specific EPG file.
-    This function always downloads fresh data from selected source URLs.
+    Fresh data is downloaded from the selected source URLs, unless a job-scoped
+    source_cache already holds the payload of a source from this run. Each source is
+    serialized once into a fragment per payload (see get_source_fragments), and the
+    output is assembled by copying the kept parts of the fragments.
     """
     config = load_config()
     epg_files = config.get('epg_files', [])
@@ -142,154 +2301,509 @@ def merge_epg_file(epg_file_id):
     selected_sources = epg_file.get('sources', [])
     if not selected_sources:
         print(f"No sources selected for EPG file {epg_file.get('name', epg_file_id)}")
+        inc_metric('epg_merges_total', epg_file=epg_file_id, result='failure')
         return False
     
+    started = time.time()
     epg_name = epg_file.get('name', epg_file_id)
     print(f"Starting EPG merge for '{epg_name}' at {datetime.now()} - Fetching fresh data from {len(selected_sources)} sources")
     
+    # Resolve the enabled sources in their configured order
+    all_sources = {s.get('id'): s for s in config.get('sources', [])}
+    sources = []
+    for source_id in selected_sources:
+        source = all_sources.get(source_id)
+        if source and source.get('enabled', True):
+            sources.append(source)
+    
     # Update job status
     update_job_status(
         current_epg_file=epg_name,
         current_step=f"Starting merge for '{epg_name}'",
-        total_sources=len(selected_sources),
+        total_sources=len(sources),
         sources_completed=0
     )
     
-    # Create root element
-    root = ET.Element('tv')
-    root.set('generator-info-name', 'EPG Merger')
-    root.set('generator-info-url', 'http://localhost')
-    
-    channels = {}
-    programmes = []
-    
-    # Get all sources
-    all_sources = config.get('sources', [])
+    # Download all sources concurrently
+    payload_paths = fetch_sources(sources, config, source_cache)
+    if source_cache is None:
+        flush_source_last_fetched()
     
-    # Fetch and parse each selected source
-    for source_id in selected_sources:
-        source = None
-        for s in all_sources:
-            if s.get('id') == source_id:
-                source = s
-                break
-        
-        if not source or not source.get('enabled', True):
-            continue
+    # Stream the merged output straight to disk
+    output_file = EPG_FILES_DIR / f"{epg_file_id}.xml"
+    pretty_print = get_epg_setting(config, epg_file, 'pretty_print', False)
+    encodings = config.get('output_encodings', DEFAULT_OUTPUT_ENCODINGS)
+    seen_channels = set()
+    contributions = []
+    
+    # Drop duplicate and overlapping programmes by source priority
+    programme_index = ProgrammeIndex() if get_epg_setting(config, epg_file, 'dedupe_programmes', True) else None
+    
+    # Only keep programmes within the configured time window
+    past_days = epg_file.get('past_days')
+    future_days = epg_file.get('future_days')
+    window_start = started - float(past_days) * 86400 if past_days is not None else None
+    window_end = started + float(future_days) * 86400 if future_days is not None else None
+    
+    # Only keep allowlisted channels, optionally renamed
+    channel_map = get_channel_map(epg_file)
+    
+    # Precompressed copies that are no longer configured would go stale
+    for encoding, suffix in OUTPUT_ENCODINGS.items():
+        stale_file = output_file.with_name(output_file.name + suffix)
+        if encoding not in encodings and stale_file.exists():
+            stale_file.unlink()
+    
+    # Only sources whose payload changed are parsed again
+    fragments = get_source_fragments(
+        sources, payload_paths, channel_map, pretty_print, past_days, started,
+        max(1, int(config.get('parse_workers', DEFAULT_PARSE_WORKERS))))
+    
+    # Point the channel icons to the local logo cache
+    logo_hashes = {}
+    if get_epg_setting(config, epg_file, 'cache_logos', False):
+        public_base_url = config.get('public_base_url', '').rstrip('/')
+        if public_base_url:
+            logo_hashes = prefetch_logos(collect_channel_icons(fragments), config)
+        else:
+            print("cache_logos needs public_base_url in the config, keeping the upstream logo URLs")
+    
+    # Build the guide index of the output alongside it; it is published right after
+    # the output, or discarded with it
+    guide_path = EPG_FILES_DIR / f"{epg_file_id}.db"
+    guide = GuideIndexWriter(guide_path) if get_epg_setting(config, epg_file, 'guide_index', True) else None
+    if guide is None and guide_path.exists():
+        guide_path.unlink()
+    
+    # Index the output so it can be published as a version that deltas are computed from
+    keep_versions = int(config.get('output_versions', DEFAULT_OUTPUT_VERSIONS))
+    output_index = OutputIndex() if keep_versions > 0 else None
+    
+    # Optionally group the programmes by channel, sorted by start time
+    sorter = None
+    if get_epg_setting(config, epg_file, 'sort_programmes', False):
+        memory_budget = float(config.get('sort_memory_budget', DEFAULT_SORT_MEMORY_BUDGET)) * 1024 * 1024
+        sorter = ProgrammeSorter(memory_budget, EPG_FILES_DIR)
+    
+    with guide or nullcontext(), XMLTVWriter(output_file, pretty_print=pretty_print, encodings=encodings,
+                                            index=output_index, guide=guide) as writer, sorter or nullcontext():
+        # Write the channels of all sources first (XMLTV puts them before the programmes),
+        # so the programmes go straight to the outputs. Sources are merged in configured
+        # order so the first-seen channel wins.
+        merged = []
+        for source, fragment_entry in zip(sources, fragments):
+            if fragment_entry is None:
+                continue
             
-        url = source.get('url')
-        source_name = source.get('name', 'Unnamed Source')
-        
-        # Update job status for current source
-        update_job_status(
-            current_source=source_name,
-            current_step=f"Downloading from {source_name}",
-            sources_completed=job_status['sources_completed']
-        )
-        
-        print(f"Fetching from {url}")
-        xml_root = fetch_xml(url)
+            fragment_path, fragment, reused = fragment_entry
+            contribution = {
+                'id': source.get('id'),
+                'name': source.get('name', 'Unnamed Source'),
+                'channels': 0,
+                'programmes': 0,
+                'programmes_removed': 0,
+                'channels_pruned': 0,
+                'programmes_pruned': 0
+            }
+            contributions.append(contribution)
+            merged.append((source, fragment_entry, contribution))
+            try:
+                with open(fragment_path, 'rb') as f:
+                    # Write channels (avoid duplicates)
+                    for channel_id, offset, length in fragment.channels:
+                        if channel_id not in seen_channels:
+                            seen_channels.add(channel_id)
+                            f.seek(offset)
+                            data = f.read(length)
+                            if logo_hashes:
+                                data = rewrite_channel_icons(data, logo_hashes, public_base_url)
+                            writer.write_raw_channel(data, channel_id)
+                            contribution['channels'] += 1
+            except OSError as e:
+                print(f"Error reading the data of {contribution['name']}: {str(e)}")
         
-        if xml_root is None:
+        for source, fragment_entry, contribution in merged:
+            fragment_path, fragment, reused = fragment_entry
+            source_name = contribution['name']
             update_job_status(
-                current_step=f"Failed to fetch from {source_name}",
-                sources_completed=job_status['sources_completed'] + 1
+                current_step=f"{'Reusing' if reused else 'Processing'} data from {source_name}"
             )
-            continue
+            if fragment.error:
+                print(f"Error parsing {source.get('url')}: {fragment.error}")
+                update_job_status(current_step=f"Failed to parse data from {source_name}")
+                if not reused:
+                    inc_metric('epg_source_failures_total', source=source.get('id'), stage='parse')
+            
+            element_filter = ElementFilter(window_start, window_end)
+            assemble_started = time.perf_counter()
+            try:
+                with open(fragment_path, 'rb') as f:
+                    # Copy the kept programmes in runs of adjacent ones
+                    run = []
+                    run_length = 0
+                    
+                    def flush_run():
+                        run_offset = run[0][3]
+                        f.seek(run_offset)
+                        data = f.read(run_length)
+                        if len(data) != run_length:
+                            raise OSError(f"Unexpected end of {fragment_path}")
+                        if sorter is not None:
+                            sorter.add_programmes(data, run, run_offset, source.get('id'))
+                        else:
+                            writer.write_raw_programmes(data, len(run), run, run_offset, source.get('id'))
+                    
+                    for record in fragment.iter_programmes():
+                        channel_id, start, stop, offset, length = record
+                        if not element_filter.accept_times(start, stop):
+                            contribution['programmes_pruned'] += 1
+                            continue
+                        if programme_index is not None and not programme_index.add(channel_id, start, stop):
+                            contribution['programmes_removed'] += 1
+                            continue
+                        # Runs are bounded so a run never holds much more than a chunk
+                        if run and (offset != run[-1][3] + run[-1][4] or run_length >= STREAM_CHUNK_SIZE):
+                            flush_run()
+                            run = []
+                            run_length = 0
+                        run.append(record)
+                        run_length += length
+                        contribution['programmes'] += 1
+                    if run:
+                        flush_run()
+            except OSError as e:
+                print(f"Error reading the data of {source_name}: {str(e)}")
+                update_job_status(current_step=f"Failed to parse data from {source_name}")
+            finally:
+                if programme_index is not None:
+                    programme_index.end_source()
+                observe_metric('epg_stage_duration_seconds', time.perf_counter() - assemble_started,
+                               stage='assemble', source=source.get('id'))
+            
+            contribution['channels_pruned'] = fragment.rejected['channel']
+            contribution['programmes_pruned'] += fragment.rejected['programme']
+            
+            outcomes = {
+                ('channel', 'kept'): contribution['channels'],
+                ('channel', 'pruned'): contribution['channels_pruned'],
+                ('channel', 'duplicate'): len(fragment.channels) - contribution['channels'],
+                ('programme', 'kept'): contribution['programmes'],
+                ('programme', 'pruned'): contribution['programmes_pruned'],
+                ('programme', 'duplicate'): contribution['programmes_removed']
+            }
+            for (tag, outcome), count in outcomes.items():
+                inc_metric('epg_elements_total', count, source=source.get('id'), epg_file=epg_file_id,
+                           tag=tag, outcome=outcome)
+            
+            if contribution['programmes_removed']:
+                print(f"Removed {contribution['programmes_removed']} duplicate or overlapping programmes from {source_name}")
         
-        # Update the last_fetched timestamp for this source
-        update_source_last_fetched(source_id)
+        if sorter is not None:
+            update_job_status(current_step=f"Sorting programmes for '{epg_name}'")
+            sort_started = time.perf_counter()
+            sorter.write_to(writer)
+            observe_metric('epg_stage_duration_seconds', time.perf_counter() - sort_started,
+                           stage='sort', source='')
         
-        # Update job status after successful fetch
+        # Update job status for writing
         update_job_status(
-            current_step=f"Processing data from {source_name}",
-            sources_completed=job_status['sources_completed'] + 1
+            current_step=f"Writing merged data for '{epg_name}'"
         )
-        
-        # Extract channels (avoid duplicates)
-        for channel in xml_root.findall('channel'):
-            channel_id = channel.get('id')
-            if channel_id and channel_id not in channels:
-                channels[channel_id] = channel
-        
-        # Extract programmes
-        for programme in xml_root.findall('programme'):
-            programmes.append(programme)
     
-    # Add channels to merged XML
-    for channel in channels.values():
-        root.append(channel)
+    channels_count = writer.channels_count
+    programmes_count = writer.programmes_count
+    
+    inc_metric('epg_merges_total', epg_file=epg_file_id, result='success')
+    observe_metric('epg_merge_duration_seconds', time.time() - started, epg_file=epg_file_id)
+    for encoding, info in writer.files.items():
+        set_metric('epg_output_bytes', info['size'], epg_file=epg_file_id, encoding=encoding)
+    
+    # Record the statistics next to the output so they never require a reparse
+    meta = {
+        'channels_count': channels_count,
+        'programmes_count': programmes_count,
+        'files': writer.files,
+        'sources': contributions,
+        'duration': round(time.time() - started, 3),
+        'generated_at': datetime.now().isoformat()
+    }
+    if output_index is not None:
+        meta['version'] = publish_epg_version(epg_file_id, output_index, meta, keep_versions)
+    else:
+        delete_epg_versions(epg_file_id)
+    write_epg_output_meta(epg_file_id, meta)
     
-    # Add programmes to merged XML
-    for programme in programmes:
-        root.append(programme)
+    # Update job status for completion
+    update_job_status(
+        current_step=f"Completed '{epg_name}' - {channels_count} channels, {programmes_count} programmes"
+    )
     
-    # Update job status for merging
+    print(f"EPG merge completed for '{epg_name}'. Total channels: {channels_count}, Total programmes: {programmes_count}")
+    return True
+
+
+def get_stored_payloads(source_ids):
+    """Get a source_cache with the stored payloads of sources that should not be fetched"""
+    source_cache = {}
+    for source_id in source_ids:
+        payload_path, _ = get_source_cache_paths(source_id)
+        if payload_path.exists():
+            source_cache[source_id] = payload_path
+    return source_cache
+
+
+def merge_epg_files(epg_files, source_cache):
+    """Merge several EPG files, sharing the downloaded sources through source_cache"""
+    # Initialize job status
     update_job_status(
-        current_step=f"Merging data for '{epg_name}'"
+        current_step="Starting EPG merge job",
+        progress=0,
+        total_steps=len(epg_files)
     )
     
-    # Create XML tree and write to file
-    output_file = EPG_FILES_DIR / f"{epg_file_id}.xml"
-    tree = ET.ElementTree(root)
-    ET.indent(tree, space="  ")
-    tree.write(output_file, encoding='utf-8', xml_declaration=True)
+    success_count = 0
+    try:
+        for i, epg_file in enumerate(epg_files):
+            epg_name = epg_file.get('name', epg_file.get('id'))
+            update_job_status(
+                progress=i,
+                current_step=f"Processing EPG file {i+1}/{len(epg_files)}: {epg_name}"
+            )
+            
+            if merge_epg_file(epg_file.get('id'), source_cache):
+                success_count += 1
+    finally:
+        # Forget the downloaded sources as soon as the job ends
+        source_cache.clear()
+        flush_source_last_fetched()
+        prune_source_fragments()
+        prune_logo_cache()
     
-    # Update job status for completion
+    # Final job status
     update_job_status(
-        current_step=f"Completed '{epg_name}' - {len(channels)} channels, {len(programmes)} programmes"
+        current_step=f"Job completed - {success_count}/{len(epg_files)} EPG files processed",
+        progress=len(epg_files)
     )
     
-    print(f"EPG merge completed for '{epg_name}'. Total channels: {len(channels)}, Total programmes: {len(programmes)}")
-    return True
+    print(f"Completed merging {success_count}/{len(epg_files)} EPG files")
+    return success_count > 0
+
+
+def merge_all_epg_files(reuse_scheduled_sources=False):
+    """
+    Merge all EPG files.
+    With reuse_scheduled_sources, sources that have their own refresh_interval are not
+    fetched; their stored payloads are used instead.
+    """
+    config = load_config()
+    epg_files = config.get('epg_files', [])
+    
+    if not epg_files:
+        print("No EPG files configured")
+        update_job_status(
+            current_step="No EPG files configured",
+            error="No EPG files configured"
+        )
+        return False
+    
+    # Sources shared between EPG files are downloaded once per job
+    source_cache = {}
+    if reuse_scheduled_sources:
+        source_cache = get_stored_payloads(
+            s.get('id') for s in config.get('sources', []) if s.get('refresh_interval'))
+    
+    return merge_epg_files(epg_files, source_cache)
+
+
+def merge_source_epg_files(source_id):
+    """
+    Refresh a single source and merge only the EPG files that include it.
+    The other sources of those EPG files are not fetched; their stored payloads are used.
+    """
+    config = load_config()
+    epg_files = [ef for ef in config.get('epg_files', []) if source_id in ef.get('sources', [])]
+    
+    if not epg_files:
+        print(f"No EPG files include source {source_id}")
+        update_job_status(current_step="No EPG files include this source")
+        return True
+    
+    other_sources = {sid for ef in epg_files for sid in ef.get('sources', [])} - {source_id}
+    return merge_epg_files(epg_files, get_stored_payloads(other_sources))
+
+
+def get_epg_output_meta_path(epg_file_id):
+    """Get the path of the metadata sidecar of a merged EPG file"""
+    return EPG_FILES_DIR / f"{epg_file_id}.meta.json"
+
+
+def write_epg_output_meta(epg_file_id, meta):
+    """Write the metadata sidecar of a merged EPG file"""
+    write_bytes_atomic(get_epg_output_meta_path(epg_file_id), json.dumps(meta, indent=2).encode('utf-8'))
+
+
+def get_epg_output_meta(epg_file_id):
+    """
+    Get the metadata sidecar of a merged EPG file.
+    The sidecar is rebuilt by streaming through the output only when the output was
+    changed by something other than a merge (its mtime no longer matches).
+    """
+    epg_file_path = EPG_FILES_DIR / f"{epg_file_id}.xml"
+    if not epg_file_path.exists():
+        return None
+    
+    stat = epg_file_path.stat()
+    meta_path = get_epg_output_meta_path(epg_file_id)
+    if meta_path.exists():
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            identity = meta.get('files', {}).get('identity', {})
+            if identity.get('mtime_ns') == stat.st_mtime_ns and identity.get('size') == stat.st_size:
+                return meta
+        except (OSError, ValueError):
+            pass
+    
+    print(f"Rebuilding metadata for EPG file {epg_file_id}")
+    channels_count = 0
+    programmes_count = 0
+    for element in iter_xmltv_elements(epg_file_path):
+        if element.tag == 'channel':
+            channels_count += 1
+        elif element.tag == 'programme':
+            programmes_count += 1
+    
+    meta = {
+        'channels_count': channels_count,
+        'programmes_count': programmes_count,
+        'files': {
+            'identity': {
+                'size': stat.st_size,
+                'sha256': get_file_etag(epg_file_path),
+                'mtime_ns': stat.st_mtime_ns
+            }
+        },
+        'sources': [],
+        'duration': None,
+        'generated_at': None
+    }
+    write_epg_output_meta(epg_file_id, meta)
+    return meta
 
 
-def merge_all_epg_files():
-    """Merge all EPG files"""
-    config = load_config()
-    epg_files = config.get('epg_files', [])
-    
-    if not epg_files:
-        print("No EPG files configured")
-        update_job_status(
-            is_running=False,
-            current_step="No EPG files configured",
-            error="No EPG files configured"
-        )
-        return False
-    
-    # Initialize job status
-    update_job_status(
-        is_running=True,
-        current_step="Starting EPG merge job",
-        progress=0,
-        total_steps=len(epg_files),
-        start_time=datetime.now().isoformat(),
-        end_time=None,
-        error=None
-    )
+def get_epg_versions_dir(epg_file_id):
+    """Get the directory with the published versions of a merged EPG file"""
+    return VERSIONS_DIR / epg_file_id
+
+
+def get_epg_versions(epg_file_id):
+    """Get the numbers of the kept versions of a merged EPG file, oldest first"""
+    versions_dir = get_epg_versions_dir(epg_file_id)
+    if not versions_dir.exists():
+        return []
+    return sorted(int(path.name[:-len('.meta.json')]) for path in versions_dir.glob('*.meta.json')
+                  if path.name[:-len('.meta.json')].isdigit())
+
+
+def read_epg_version_meta(epg_file_id, version):
+    """Read the metadata of a kept version of a merged EPG file, or None"""
+    try:
+        with open(get_epg_versions_dir(epg_file_id) / f"{version}.meta.json", 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def publish_epg_version(epg_file_id, index, meta, keep):
+    """
+    Keep the output that was just published as a numbered version, with its index.
+    The files are hard links to the output, which the next merge replaces rather than
+    rewrites, so a version costs no copy. An unchanged output keeps its version number.
+    Returns the version number.
+    """
+    versions_dir = get_epg_versions_dir(epg_file_id)
+    versions_dir.mkdir(exist_ok=True)
+    versions = get_epg_versions(epg_file_id)
+    output_file = EPG_FILES_DIR / f"{epg_file_id}.xml"
     
-    success_count = 0
-    for i, epg_file in enumerate(epg_files):
-        epg_name = epg_file.get('name', epg_file.get('id'))
-        update_job_status(
-            progress=i,
-            current_step=f"Processing EPG file {i+1}/{len(epg_files)}: {epg_name}"
-        )
-        
-        if merge_epg_file(epg_file.get('id')):
-            success_count += 1
+    if versions:
+        previous = read_epg_version_meta(epg_file_id, versions[-1])
+        if previous and previous['files']['identity']['sha256'] == meta['files']['identity']['sha256']:
+            return versions[-1]
+    version = versions[-1] + 1 if versions else 1
     
-    # Final job status
-    update_job_status(
-        is_running=False,
-        current_step=f"Job completed - {success_count}/{len(epg_files)} EPG files processed",
-        progress=len(epg_files),
-        end_time=datetime.now().isoformat()
-    )
+    for encoding in meta['files']:
+        suffix = OUTPUT_ENCODINGS.get(encoding, '')
+        target = versions_dir / f"{version}.xml{suffix}"
+        target.unlink(missing_ok=True)
+        try:
+            os.link(output_file.with_name(output_file.name + suffix), target)
+        except OSError:
+            shutil.copy2(output_file.with_name(output_file.name + suffix), target)
+    write_bytes_atomic(versions_dir / f"{version}.idx", index.to_bytes())
+    write_bytes_atomic(versions_dir / f"{version}.meta.json",
+                       json.dumps(dict(meta, version=version), indent=2).encode('utf-8'))
     
-    print(f"Completed merging {success_count}/{len(epg_files)} EPG files")
-    return success_count > 0
+    for old_version in versions[:max(0, len(versions) + 1 - keep)]:
+        for path in versions_dir.glob(f"{old_version}.*"):
+            path.unlink(missing_ok=True)
+    return version
+
+
+def delete_epg_versions(epg_file_id):
+    """Remove the kept versions of a merged EPG file"""
+    shutil.rmtree(get_epg_versions_dir(epg_file_id), ignore_errors=True)
+
+
+def get_epg_delta(epg_file_id, since, version):
+    """
+    Get the channels and programmes added, changed or removed between two kept versions.
+    Elements are compared by hash; a removed programme is reported as changed when the
+    new version has a programme on the same channel at the same start.
+    """
+    versions_dir = get_epg_versions_dir(epg_file_id)
+    old = OutputIndex.from_file(versions_dir / f"{since}.idx")
+    new = OutputIndex.from_file(versions_dir / f"{version}.idx")
+    
+    old_channels = {channel_id: digest for channel_id, _, _, digest in old.channels}
+    new_channel_ids = {channel_id for channel_id, _, _, _ in new.channels}
+    delta_channels = [(channel_id, offset, length, 'added' if channel_id not in old_channels else 'changed')
+                      for channel_id, offset, length, digest in new.channels
+                      if old_channels.get(channel_id) != digest]
+    removed_channels = [channel_id for channel_id in old_channels if channel_id not in new_channel_ids]
+    
+    old_hashes = set(old.hashes)
+    new_hashes = set(new.hashes)
+    removed = [(channel_id, start, stop) for (channel_id, start, stop, _, _), digest
+               in zip(old.iter_programmes(), old.hashes) if digest not in new_hashes]
+    removed_keys = {(channel_id, start) for channel_id, start, _ in removed}
+    delta_programmes = []
+    for (channel_id, start, stop, offset, length), digest in zip(new.iter_programmes(), new.hashes):
+        if digest not in old_hashes:
+            key = (channel_id, start)
+            delta_programmes.append((offset, length, 'changed' if key in removed_keys else 'added'))
+            removed_keys.discard(key)
+    
+    delta = {
+        'epg_file_id': epg_file_id,
+        'since': since,
+        'version': version,
+        'channels': {'added': [], 'changed': [], 'removed': removed_channels},
+        'programmes': {'added': [], 'changed': [], 'removed': []}
+    }
+    with open(versions_dir / f"{version}.xml", 'rb') as f:
+        for _, offset, length, kind in delta_channels:
+            f.seek(offset)
+            delta['channels'][kind].append(f.read(length).decode('utf-8').strip())
+        for offset, length, kind in delta_programmes:
+            f.seek(offset)
+            delta['programmes'][kind].append(f.read(length).decode('utf-8').strip())
+    
+    # Changed programmes replace the removed one with the same key
+    delta['programmes']['removed'] = [
+        {'channel': channel_id, 'start': format_guide_time(start), 'stop': format_guide_time(stop)}
+        for channel_id, start, stop in removed if (channel_id, start) in removed_keys]
+    return delta
 
 
 def get_epg_file_stats(epg_file_id):
@@ -299,21 +2813,25 @@ def get_epg_file_stats(epg_file_id):
         return None
     
     try:
-        tree = ET.parse(epg_file_path)
-        root = tree.getroot()
-        
-        channels = root.findall('channel')
-        programmes = root.findall('programme')
+        meta = get_epg_output_meta(epg_file_id)
+        if meta is None:
+            return None
         
-        file_size = epg_file_path.stat().st_size
-        last_modified = datetime.fromtimestamp(epg_file_path.stat().st_mtime)
+        identity = meta['files']['identity']
+        file_size = identity['size']
+        last_modified = datetime.fromtimestamp(identity['mtime_ns'] / 1e9)
         
         return {
-            'channels_count': len(channels),
-            'programmes_count': len(programmes),
+            'channels_count': meta['channels_count'],
+            'programmes_count': meta['programmes_count'],
             'file_size': file_size,
             'file_size_mb': round(file_size / (1024 * 1024), 2),
-            'last_modified': last_modified.strftime('%Y-%m-%d %H:%M:%S')
+            'last_modified': last_modified.strftime('%Y-%m-%d %H:%M:%S'),
+            'sha256': identity['sha256'],
+            'compressed_sizes': {encoding: info['size'] for encoding, info in meta['files'].items()
+                                 if encoding != 'identity'},
+            'sources': meta.get('sources', []),
+            'duration': meta.get('duration')
         }
     except Exception as e:
         print(f"Error getting stats for {epg_file_id}: {str(e)}")
@@ -340,24 +2858,445 @@ def get_all_epg_stats():
     return stats
 
 
+# Channel-subset variants are generated one at a time per process
+variants_lock = threading.Lock()
+
+
+def get_epg_variant_paths(epg_file_id, channel_ids):
+    """Get the output and metadata paths of a channel-subset variant of a merged EPG file"""
+    key = hashlib.sha256('\n'.join(sorted(channel_ids)).encode('utf-8')).hexdigest()[:16]
+    base = f"{epg_file_id}.{key}"
+    return VARIANTS_DIR / f"{base}.xml", VARIANTS_DIR / f"{base}.meta.json"
+
+
+def read_epg_variant_meta(meta_path):
+    """Read the metadata of a cached variant, or None"""
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_epg_variant(epg_file_id, channel_ids, parent_sha256, pretty_print=False, encodings=()):
+    """
+    Write the variant of a merged EPG file that only has the given channels.
+    The variant is streamed from the merged output, so it never needs a merge.
+    """
+    variant_path, meta_path = get_epg_variant_paths(epg_file_id, channel_ids)
+    element_filter = ElementFilter(channel_ids=set(channel_ids))
+    
+    with XMLTVWriter(variant_path, pretty_print=pretty_print, encodings=encodings) as writer:
+        batch = []
+        for element in iter_xmltv_elements(EPG_FILES_DIR / f"{epg_file_id}.xml", element_filter):
+            if element.tag in ('channel', 'programme'):
+                batch.append(element)
+                if len(batch) >= SERIALIZE_BATCH_SIZE:
+                    writer.write_elements(batch)
+                    batch.clear()
+        writer.write_elements(batch)
+    
+    meta = {
+        'epg_file_id': epg_file_id,
+        'channels': sorted(channel_ids),
+        'parent_sha256': parent_sha256,
+        'channels_count': writer.channels_count,
+        'programmes_count': writer.programmes_count,
+        'files': writer.files,
+        'generated_at': datetime.now().isoformat()
+    }
+    write_bytes_atomic(meta_path, json.dumps(meta, indent=2).encode('utf-8'))
+    return meta
+
+
+def get_epg_variant(epg_file_id, channel_ids, config, epg_file):
+    """
+    Get the path and metadata of the variant of a merged EPG file with only the given
+    channels. Cached variants are reused until the merged output changes; otherwise the
+    variant is generated and the least recently used variants are evicted.
+    """
+    parent_meta = get_epg_output_meta(epg_file_id)
+    if parent_meta is None:
+        return None, None
+    parent_sha256 = parent_meta['files']['identity']['sha256']
+    variant_path, meta_path = get_epg_variant_paths(epg_file_id, channel_ids)
+    
+    meta = read_epg_variant_meta(meta_path)
+    if meta is None or meta.get('parent_sha256') != parent_sha256 or not variant_path.exists():
+        with variants_lock:
+            meta = read_epg_variant_meta(meta_path)
+            if meta is None or meta.get('parent_sha256') != parent_sha256 or not variant_path.exists():
+                print(f"Generating a {len(channel_ids)} channel variant of EPG file {epg_file_id}")
+                meta = build_epg_variant(
+                    epg_file_id, channel_ids, parent_sha256,
+                    get_epg_setting(config, epg_file, 'pretty_print', False),
+                    config.get('output_encodings', DEFAULT_OUTPUT_ENCODINGS))
+                evict_epg_variants(config.get('variant_cache_size', DEFAULT_VARIANT_CACHE_SIZE) * 1024 * 1024,
+                                   keep=meta_path)
+    
+    # Mark the variant as recently used
+    try:
+        os.utime(meta_path)
+    except OSError:
+        pass
+    return variant_path, meta
+
+
+def evict_epg_variants(max_bytes, keep=None):
+    """Remove the least recently used variants until the cache fits in max_bytes"""
+    variants = []
+    for meta_path in VARIANTS_DIR.glob('*.meta.json'):
+        base = meta_path.name[:-len('.meta.json')]
+        files = [path for path in VARIANTS_DIR.glob(f"{base}.*")]
+        try:
+            used = meta_path.stat().st_mtime
+            size = sum(path.stat().st_size for path in files)
+        except OSError:
+            continue
+        variants.append((used, size, meta_path, files))
+    
+    total = sum(size for _, size, _, _ in variants)
+    for used, size, meta_path, files in sorted(variants, key=lambda variant: variant[0]):
+        if total <= max_bytes:
+            break
+        if meta_path == keep:
+            continue
+        for path in files:
+            path.unlink(missing_ok=True)
+        total -= size
+
+
+def delete_epg_variants(epg_file_id):
+    """Remove the cached variants of a merged EPG file"""
+    for path in VARIANTS_DIR.glob(f"{epg_file_id}.*"):
+        path.unlink(missing_ok=True)
+
+
+def open_guide_index(epg_file_id):
+    """
+    Open the guide index of a merged EPG file read-only (a GuideIndexReader), or return
+    None when it has none. An index written by an older version, or for another output
+    (while a merge publishes a new one), counts as none.
+    """
+    path = EPG_FILES_DIR / f"{epg_file_id}.db"
+    if not path.exists():
+        return None
+    db = sqlite3.connect(f"file:{path.resolve()}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    try:
+        output_info = None
+        if db.execute("PRAGMA user_version").fetchone()[0] == GUIDE_SCHEMA_VERSION:
+            output_info = db.execute("SELECT * FROM output").fetchone()
+        if output_info is not None:
+            output = open(EPG_FILES_DIR / f"{epg_file_id}.xml", 'rb')
+            stat = os.fstat(output.fileno())
+            if stat.st_size == output_info['size'] and stat.st_mtime_ns == output_info['mtime_ns']:
+                return GuideIndexReader(db, output, output_info['programmes_offset'])
+            output.close()
+    except (OSError, sqlite3.Error):
+        pass
+    db.close()
+    return None
+
+
+def parse_guide_time(value, default=None):
+    """Parse a time query parameter: a Unix timestamp, an ISO 8601 time or an XMLTV time"""
+    if value is None or value == '':
+        return default
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return int(parsed.timestamp())
+    except ValueError:
+        pass
+    parsed = parse_xmltv_time(value)
+    if parsed is None:
+        raise ValueError(f"Invalid time: {value}")
+    return parsed
+
+
+def format_guide_time(value):
+    """Format a Unix timestamp as an ISO 8601 UTC time"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+
+def format_guide_programme(guide, row):
+    """Turn a programme row of the guide index into JSON"""
+    element = guide.read_programme(row)
+    return {
+        'channel': row['channel'],
+        'start': format_guide_time(row['start']),
+        'stop': format_guide_time(row['stop']),
+        'title': element.findtext('title'),
+        'sub_title': element.findtext('sub-title'),
+        'desc': element.findtext('desc'),
+        'categories': [category.text for category in element.findall('category') if category.text],
+        'icon': element.find('icon').get('src') if element.find('icon') is not None else None,
+        'source': row['source']
+    }
+
+
+def format_guide_channel(guide, row):
+    """Turn a channel row of the guide index into JSON"""
+    element = guide.read_channel(row)
+    return {
+        'id': row['id'],
+        'display_names': [name.text for name in element.findall('display-name') if name.text],
+        'icon': element.find('icon').get('src') if element.find('icon') is not None else None
+    }
+
+
+def get_guide_now_next(db, at, channel_ids=None):
+    """Get the programme airing at `at` and the one after it, per channel"""
+    if channel_ids is None:
+        channel_ids = [row['id'] for row in db.execute("SELECT id FROM channels ORDER BY id")]
+    
+    guide = []
+    for channel_id in channel_ids:
+        now = db.execute(
+            "SELECT * FROM programmes WHERE channel = ? AND start <= ? AND stop > ? "
+            "ORDER BY start DESC LIMIT 1", (channel_id, at, at)).fetchone()
+        following = db.execute(
+            "SELECT * FROM programmes WHERE channel = ? AND start >= ? "
+            "ORDER BY start LIMIT 1", (channel_id, now['stop'] if now is not None else at)).fetchone()
+        guide.append({
+            'channel': channel_id,
+            'now': format_guide_programme(db, now) if now is not None else None,
+            'next': format_guide_programme(db, following) if following is not None else None
+        })
+    return guide
+
+
+def get_file_etag(path):
+    """
+    Get a strong ETag for a file based on its content.
+    The SHA-256 is computed once per file version and cached by mtime and size.
+    """
+    stat = path.stat()
+    key = str(path)
+    with file_etags_lock:
+        cached = file_etags.get(key)
+        if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+    
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+    
+    with file_etags_lock:
+        file_etags[key] = ((stat.st_mtime_ns, stat.st_size), etag)
+    return etag
+
+
+def send_epg_output(epg_id, epg_name, epg_file_path=None, meta=None):
+    """
+    Send a merged EPG file (or a channel-subset variant of it at epg_file_path, with its
+    metadata), picking the best precompressed copy the client accepts.
+    Responses carry a strong content-based ETag and answer If-None-Match with a 304.
+    """
+    if epg_file_path is None:
+        epg_file_path = EPG_FILES_DIR / f"{epg_id}.xml"
+        meta = get_epg_output_meta(epg_id)
+    
+    path = epg_file_path
+    content_encoding = None
+    best_quality = 0
+    for encoding, suffix in OUTPUT_ENCODINGS.items():
+        quality = request.accept_encodings[encoding]
+        candidate = epg_file_path.with_name(epg_file_path.name + suffix)
+        if quality > best_quality and candidate.exists():
+            path = candidate
+            content_encoding = encoding
+            best_quality = quality
+    
+    # Prefer the hash recorded by the merge over hashing the file again
+    stat = path.stat()
+    info = (meta or {}).get('files', {}).get(content_encoding or 'identity', {})
+    if info.get('mtime_ns') == stat.st_mtime_ns and info.get('size') == stat.st_size:
+        etag = info['sha256']
+    else:
+        etag = get_file_etag(path)
+    
+    response = send_file(
+        path,
+        mimetype='application/xml',
+        as_attachment=True,
+        download_name=f'{epg_name}.xml',
+        etag=etag,
+        conditional=True
+    )
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    
+    inc_metric('epg_download_requests_total', epg_file=epg_id, status=str(response.status_code))
+    if response.content_length:
+        inc_metric('epg_download_bytes_total', response.content_length, epg_file=epg_id,
+                   encoding=content_encoding or 'identity')
+    return response
+
+
+def get_source_schedules(config):
+    """Get the refresh interval and jitter of every enabled source with its own schedule"""
+    schedules = {}
+    for source in config.get('sources', []):
+        interval = source.get('refresh_interval')
+        if not interval or not source.get('enabled', True):
+            continue
+        jitter = source.get('refresh_jitter', interval * DEFAULT_REFRESH_JITTER_RATIO)
+        schedules[source.get('id')] = (int(interval), int(jitter))
+    return schedules
+
+
+def get_schedule_signature(config):
+    """Get everything the leader's schedule depends on, to detect changes"""
+    return config.get('schedule_interval', 7200), get_source_schedules(config)
+
+
+def get_refresh_offset(source_id, interval):
+    """
+    Get a stable offset into the interval for the first refresh of a source, so the
+    refreshes of sources are spread over time instead of starting together.
+    """
+    return int(hashlib.sha256(source_id.encode('utf-8')).hexdigest(), 16) % max(1, interval)
+
+
 def schedule_merge_job():
-    """Schedule the merge job based on configuration"""
+    """Schedule the merge job and the refreshes of sources with their own interval"""
     config = load_config()
     interval = config.get('schedule_interval', 7200)
     
-    # Remove existing jobs
-    scheduler.remove_all_jobs()
+    # Add or replace the merge job when its interval changed
+    previous = leader_state['schedule_signature']
+    if previous is None or previous[0] != interval:
+        scheduler.add_job(
+            func=run_scheduled_merge,
+            trigger='interval',
+            seconds=interval,
+            id='epg_merge_job',
+            name='EPG Merge Job',
+            replace_existing=True
+        )
+        print(f"Scheduled EPG merge every {interval} seconds ({interval//3600} hours, {(interval%3600)//60} minutes)")
+    
+    # Only (re)schedule the sources whose schedule changed, so their next run is kept
+    source_schedules = get_source_schedules(config)
+    for source_id in set(leader_state['source_schedules']) - set(source_schedules):
+        if scheduler.get_job(f"refresh_source:{source_id}"):
+            scheduler.remove_job(f"refresh_source:{source_id}")
+    
+    for source_id, (source_interval, jitter) in source_schedules.items():
+        if leader_state['source_schedules'].get(source_id) == (source_interval, jitter):
+            continue
+        offset = get_refresh_offset(source_id, source_interval)
+        scheduler.add_job(
+            func=run_scheduled_source_refresh,
+            args=[source_id],
+            trigger='interval',
+            seconds=source_interval,
+            jitter=jitter or None,
+            next_run_time=datetime.now() + timedelta(seconds=offset),
+            id=f"refresh_source:{source_id}",
+            name=f"Refresh Source {source_id}",
+            replace_existing=True
+        )
+        print(f"Scheduled refresh of source {source_id} every {source_interval} seconds "
+              f"(+/- {jitter} seconds), first in {offset} seconds")
+    
+    leader_state['source_schedules'] = source_schedules
+    leader_state['schedule_signature'] = get_schedule_signature(config)
+
+
+def try_acquire_leadership():
+    """Try to become the scheduler leader without waiting. Returns True when leader."""
+    with leader_lock:
+        if leader_state['lock_file'] is not None:
+            return True
+        
+        if fcntl is None:
+            # Without fcntl there is no cross-process lock; assume a single process
+            leader_state['lock_file'] = True
+            return True
+        
+        lock_file = open(SCHEDULER_LOCK_FILE, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        
+        # Record the leader's pid for troubleshooting
+        lock_file.truncate(0)
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        
+        # The lock is held for the lifetime of the process
+        leader_state['lock_file'] = lock_file
+        return True
+
+
+def is_scheduler_leader():
+    """Check whether this process runs the scheduled merges"""
+    return leader_state['lock_file'] is not None
+
+
+def check_scheduler_leadership():
+    """
+    Periodic check run in every process.
+    Takes over leadership when no other process holds it, and lets the leader pick up
+    schedule changes saved to config.json by any worker.
+    """
+    if not is_scheduler_leader():
+        if not try_acquire_leadership():
+            return
+        print(f"Process {os.getpid()} is now the scheduler leader")
     
-    # Add new job
+    config = load_config()
+    if get_schedule_signature(config) != leader_state['schedule_signature']:
+        schedule_merge_job()
+
+
+def start_scheduler():
+    """Start the leadership check; the leader schedules the merge job"""
     scheduler.add_job(
-        func=merge_all_epg_files,
+        func=check_scheduler_leadership,
         trigger='interval',
-        seconds=interval,
-        id='epg_merge_job',
-        name='EPG Merge Job',
+        seconds=LEADER_CHECK_INTERVAL,
+        id='leader_check',
+        name='Scheduler Leadership Check',
         replace_existing=True
     )
-    print(f"Scheduled EPG merge every {interval} seconds ({interval//3600} hours, {(interval%3600)//60} minutes)")
+    check_scheduler_leadership()
+
+
+def start_background_tasks():
+    """Start the scheduler and the job and metrics publishers of this process, once"""
+    with background_lock:
+        if background_state['started']:
+            return
+        background_state['started'] = True
+    
+    scheduler.start()
+    # Schedule the merge job (in the leader process only)
+    start_scheduler()
+    # Announce this worker's (empty) job history, replacing any left over under the same pid
+    publish_jobs(force=True)
+    threading.Thread(target=publish_metrics_periodically, name='metrics-publisher', daemon=True).start()
+
+
+@app.before_request
+def ensure_background_tasks():
+    """Start the background tasks under servers that do not call start_background_tasks()"""
+    start_background_tasks()
 
 
 @app.route('/')
@@ -385,27 +3324,26 @@ def add_source():
     if not url:
         return jsonify({'error': 'URL is required'}), 400
     
-    config = load_config()
-    sources = config.get('sources', [])
-    
-    # Check if URL already exists
-    if any(s['url'] == url for s in sources):
-        return jsonify({'error': 'URL already exists'}), 400
-    
     # Generate unique ID for source
     import uuid
     source_id = str(uuid.uuid4())
     
-    sources.append({
-        'id': source_id,
-        'url': url,
-        'name': name,
-        'enabled': True,
-        'added_at': datetime.now().isoformat()
-    })
+    def apply(config):
+        sources = config.setdefault('sources', [])
+        # Check if URL already exists
+        if any(s['url'] == url for s in sources):
+            return False
+        sources.append({
+            'id': source_id,
+            'url': url,
+            'name': name,
+            'enabled': True,
+            'added_at': datetime.now().isoformat()
+        })
     
-    config['sources'] = sources
-    save_config(config)
+    config = update_config(apply)
+    if not any(s.get('id') == source_id for s in config.get('sources', [])):
+        return jsonify({'error': 'URL already exists'}), 400
     
     return jsonify({'success': True, 'source_id': source_id})
 
@@ -413,49 +3351,100 @@ def add_source():
 @app.route('/api/sources/<source_id>', methods=['DELETE'])
 def delete_source(source_id):
     """Delete a source"""
-    config = load_config()
-    sources = config.get('sources', [])
+    def apply(config):
+        # Find and remove source by ID
+        config['sources'] = [s for s in config.get('sources', []) if s.get('id') != source_id]
+        
+        # Also remove from all EPG files
+        for epg_file in config.get('epg_files', []):
+            epg_sources = epg_file.get('sources', [])
+            epg_file['sources'] = [sid for sid in epg_sources if sid != source_id]
     
-    # Find and remove source by ID
-    sources = [s for s in sources if s.get('id') != source_id]
+    update_config(apply)
+    delete_source_cache(source_id)
     
-    # Also remove from all EPG files
-    epg_files = config.get('epg_files', [])
-    for epg_file in epg_files:
-        epg_sources = epg_file.get('sources', [])
-        epg_file['sources'] = [sid for sid in epg_sources if sid != source_id]
+    return jsonify({'success': True})
+
+
+@app.route('/api/sources/<source_id>/settings', methods=['POST'])
+def update_source_settings(source_id):
+    """Update the refresh schedule of a source (a null value restores the default)"""
+    data = request.get_json() or {}
+    
+    settings = {}
+    for key, value in data.items():
+        if key not in SOURCE_SETTINGS:
+            return jsonify({'error': f'Unknown setting: {key}'}), 400
+        if value is not None:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                return jsonify({'error': f'{key} must be a non-negative number'}), 400
+            if key == 'refresh_interval' and value < 60:
+                return jsonify({'error': 'refresh_interval must be at least 60 seconds'}), 400
+        settings[key] = value
+    
+    def apply(config):
+        for source in config.get('sources', []):
+            if source.get('id') == source_id:
+                for key, value in settings.items():
+                    if value is None:
+                        source.pop(key, None)
+                    else:
+                        source[key] = value
+                return
+        return False
     
-    config['sources'] = sources
-    config['epg_files'] = epg_files
-    save_config(config)
+    config = update_config(apply)
+    if not any(source.get('id') == source_id for source in config.get('sources', [])):
+        return jsonify({'error': 'Source not found'}), 404
     
+    # Other workers pass the change on to the leader through config.json
+    if is_scheduler_leader():
+        schedule_merge_job()
     return jsonify({'success': True})
 
 
 @app.route('/api/sources/<source_id>/toggle', methods=['POST'])
 def toggle_source(source_id):
     """Toggle source enabled/disabled"""
-    config = load_config()
-    sources = config.get('sources', [])
+    def apply(config):
+        for source in config.get('sources', []):
+            if source.get('id') == source_id:
+                source['enabled'] = not source.get('enabled', True)
+                return
+        return False
     
-    for source in sources:
-        if source.get('id') == source_id:
-            source['enabled'] = not source.get('enabled', True)
-            config['sources'] = sources
-            save_config(config)
-            return jsonify({'success': True})
+    config = update_config(apply)
+    if not any(source.get('id') == source_id for source in config.get('sources', [])):
+        return jsonify({'error': 'Source not found'}), 404
     
-    return jsonify({'error': 'Source not found'}), 404
+    return jsonify({'success': True})
 
 
 @app.route('/api/merge', methods=['POST'])
 def trigger_merge():
-    """Manually trigger EPG merge for all files"""
-    success = merge_all_epg_files()
-    if success:
-        return jsonify({'success': True, 'message': 'EPG merge completed'})
-    else:
-        return jsonify({'error': 'EPG merge failed'}), 500
+    """Queue an EPG merge for all files"""
+    job, created = submit_merge_job('all')
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'message': 'EPG merge queued' if created else 'EPG merge already queued or running'
+    }), 202
+
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs_api():
+    """Get the merge job history, newest first"""
+    return jsonify(get_jobs())
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_api(job_id):
+    """Get a merge job"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 
 @app.route('/api/epg-files', methods=['GET'])
@@ -474,26 +3463,25 @@ def create_epg_file():
     if not name:
         return jsonify({'error': 'Name is required'}), 400
     
-    config = load_config()
-    epg_files = config.get('epg_files', [])
-    
-    # Check if name already exists
-    if any(ef['name'] == name for ef in epg_files):
-        return jsonify({'error': 'EPG file name already exists'}), 400
-    
     # Generate unique ID
     import uuid
     epg_id = str(uuid.uuid4())
     
-    epg_files.append({
-        'id': epg_id,
-        'name': name,
-        'sources': [],
-        'created_at': datetime.now().isoformat()
-    })
+    def apply(config):
+        epg_files = config.setdefault('epg_files', [])
+        # Check if name already exists
+        if any(ef['name'] == name for ef in epg_files):
+            return False
+        epg_files.append({
+            'id': epg_id,
+            'name': name,
+            'sources': [],
+            'created_at': datetime.now().isoformat()
+        })
     
-    config['epg_files'] = epg_files
-    save_config(config)
+    config = update_config(apply)
+    if not any(ef.get('id') == epg_id for ef in config.get('epg_files', [])):
+        return jsonify({'error': 'EPG file name already exists'}), 400
     
     return jsonify({'success': True, 'epg_id': epg_id})
 
@@ -501,49 +3489,38 @@ def create_epg_file():
 @app.route('/api/epg-files/<epg_id>', methods=['DELETE'])
 def delete_epg_file(epg_id):
     """Delete an EPG file"""
-    config = load_config()
-    epg_files = config.get('epg_files', [])
+    def apply(config):
+        # Find and remove EPG file
+        config['epg_files'] = [ef for ef in config.get('epg_files', []) if ef.get('id') != epg_id]
     
-    # Find and remove EPG file
-    epg_files = [ef for ef in epg_files if ef.get('id') != epg_id]
+    update_config(apply)
     
-    # Delete the actual file
+    # Delete the actual file, its precompressed copies, its metadata and its guide index
     epg_file_path = EPG_FILES_DIR / f"{epg_id}.xml"
-    if epg_file_path.exists():
-        epg_file_path.unlink()
-    
-    config['epg_files'] = epg_files
-    save_config(config)
+    for path in [epg_file_path, get_epg_output_meta_path(epg_id), EPG_FILES_DIR / f"{epg_id}.db"] + [
+            epg_file_path.with_name(epg_file_path.name + suffix) for suffix in OUTPUT_ENCODINGS.values()]:
+        if path.exists():
+            path.unlink()
+    delete_epg_variants(epg_id)
+    delete_epg_versions(epg_id)
     
     return jsonify({'success': True})
 
 
 @app.route('/api/epg-files/<epg_id>/merge', methods=['POST'])
 def merge_single_epg_file(epg_id):
-    """Manually trigger merge for a specific EPG file"""
-    # Initialize job status for single file merge
-    update_job_status(
-        is_running=True,
-        current_step=f"Starting merge for EPG file {epg_id}",
-        progress=0,
-        total_steps=1,
-        start_time=datetime.now().isoformat(),
-        end_time=None,
-        error=None
-    )
-    
-    success = merge_epg_file(epg_id)
-    
-    # Update final status
-    update_job_status(
-        is_running=False,
-        end_time=datetime.now().isoformat()
-    )
+    """Queue a merge for a specific EPG file"""
+    config = load_config()
+    if not any(ef.get('id') == epg_id for ef in config.get('epg_files', [])):
+        return jsonify({'error': 'EPG file not found'}), 404
     
-    if success:
-        return jsonify({'success': True, 'message': 'EPG file merged successfully'})
-    else:
-        return jsonify({'error': 'EPG file merge failed'}), 500
+    job, created = submit_merge_job('epg_file', epg_id)
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'message': 'EPG file merge queued' if created else 'EPG file merge already queued or running'
+    }), 202
 
 
 @app.route('/api/epg-files/<epg_id>/sources', methods=['POST'])
@@ -552,22 +3529,69 @@ def update_epg_sources(epg_id):
     data = request.get_json()
     source_ids = data.get('sources', [])
     
-    config = load_config()
-    epg_files = config.get('epg_files', [])
+    def apply(config):
+        for epg_file in config.get('epg_files', []):
+            if epg_file.get('id') == epg_id:
+                epg_file['sources'] = source_ids
+                return
+        return False
     
-    for epg_file in epg_files:
-        if epg_file.get('id') == epg_id:
-            epg_file['sources'] = source_ids
-            config['epg_files'] = epg_files
-            save_config(config)
-            return jsonify({'success': True})
+    config = update_config(apply)
+    if not any(ef.get('id') == epg_id for ef in config.get('epg_files', [])):
+        return jsonify({'error': 'EPG file not found'}), 404
+    
+    return jsonify({'success': True})
+
+
+@app.route('/api/epg-files/<epg_id>/settings', methods=['POST'])
+def update_epg_settings(epg_id):
+    """Update merge settings for an EPG file (a null value restores the default)"""
+    data = request.get_json() or {}
+    
+    settings = {}
+    for key, value in data.items():
+        if key not in EPG_FILE_SETTINGS:
+            return jsonify({'error': f'Unknown setting: {key}'}), 400
+        if value is not None:
+            value_type = EPG_FILE_SETTINGS[key]
+            if value_type is bool and not isinstance(value, bool):
+                return jsonify({'error': f'{key} must be true or false'}), 400
+            if value_type is float and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+                return jsonify({'error': f'{key} must be a non-negative number'}), 400
+            if value_type is list and not (
+                    (isinstance(value, list) and all(isinstance(v, str) for v in value)) or
+                    (isinstance(value, dict) and all(isinstance(v, str) or v is None for v in value.values()))):
+                return jsonify({'error': f'{key} must be a list of ids or a mapping of ids'}), 400
+            if value_type is dict and not (isinstance(value, dict) and all(
+                    isinstance(v, list) and all(isinstance(c, str) for c in v) for v in value.values())):
+                return jsonify({'error': f'{key} must be a mapping of names to lists of channel ids'}), 400
+        settings[key] = value
+    
+    def apply(config):
+        for epg_file in config.get('epg_files', []):
+            if epg_file.get('id') == epg_id:
+                for key, value in settings.items():
+                    if value is None:
+                        epg_file.pop(key, None)
+                    else:
+                        epg_file[key] = value
+                return
+        return False
     
-    return jsonify({'error': 'EPG file not found'}), 404
+    config = update_config(apply)
+    if not any(ef.get('id') == epg_id for ef in config.get('epg_files', [])):
+        return jsonify({'error': 'EPG file not found'}), 404
+    
+    return jsonify({'success': True})
 
 
 @app.route('/api/epg-files/<epg_id>/download')
 def download_epg_file(epg_id):
-    """Download a specific EPG file"""
+    """
+    Download a specific EPG file.
+    ?channels=a,b or ?profile=<name> (see the 'profiles' setting) download a variant with
+    only those channels, and ?version=<n> a kept earlier version.
+    """
     epg_file_path = EPG_FILES_DIR / f"{epg_id}.xml"
     if epg_file_path.exists():
         config = load_config()
@@ -575,16 +3599,183 @@ def download_epg_file(epg_id):
         
         # Find EPG file name
         epg_name = "epg_file"
+        epg_file = {}
         for ef in epg_files:
             if ef.get('id') == epg_id:
                 epg_name = ef.get('name', 'epg_file')
+                epg_file = ef
                 break
         
-        return send_file(epg_file_path, as_attachment=True, download_name=f'{epg_name}.xml')
+        profile = request.args.get('profile')
+        channels = request.args.get('channels')
+        version = request.args.get('version')
+        if version:
+            meta = read_epg_version_meta(epg_id, version) if version.isdigit() else None
+            if meta is None:
+                return "Version not found", 404
+            return send_epg_output(epg_id, f"{epg_name}-v{version}",
+                                   get_epg_versions_dir(epg_id) / f"{version}.xml", meta)
+        if profile:
+            channel_ids = epg_file.get('profiles', {}).get(profile)
+            if channel_ids is None:
+                return "Profile not found", 404
+            epg_name = f"{epg_name}-{profile}"
+        elif channels:
+            channel_ids = [c for c in channels.split(',') if c]
+            epg_name = f"{epg_name}-subset"
+        else:
+            return send_epg_output(epg_id, epg_name)
+        
+        variant_path, meta = get_epg_variant(epg_id, channel_ids, config, epg_file)
+        if variant_path is None:
+            return "EPG file not found", 404
+        return send_epg_output(epg_id, epg_name, variant_path, meta)
     else:
         return "EPG file not found", 404
 
 
+@app.route('/api/epg-files/<epg_id>/versions', methods=['GET'])
+def get_epg_versions_api(epg_id):
+    """List the kept versions of a merged EPG file, newest first"""
+    versions = []
+    for version in reversed(get_epg_versions(epg_id)):
+        meta = read_epg_version_meta(epg_id, version)
+        if meta is not None:
+            versions.append({
+                'version': version,
+                'channels_count': meta['channels_count'],
+                'programmes_count': meta['programmes_count'],
+                'size': meta['files']['identity']['size'],
+                'sha256': meta['files']['identity']['sha256'],
+                'generated_at': meta['generated_at']
+            })
+    return jsonify(versions)
+
+
+@app.route('/api/epg-files/<epg_id>/delta', methods=['GET'])
+def get_epg_delta_api(epg_id):
+    """Changes since ?since=<version> up to the latest version (or ?version=<n>)"""
+    versions = get_epg_versions(epg_id)
+    if not versions:
+        return jsonify({'error': 'No versions found'}), 404
+    
+    try:
+        since = int(request.args['since'])
+        version = int(request.args.get('version', versions[-1]))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'since must be a version number'}), 400
+    if version not in versions or since > version:
+        return jsonify({'error': 'Version not found'}), 404
+    if since not in versions:
+        # Too old: the client has to download the full output again
+        return jsonify({'error': f'Version {since} is no longer kept', 'versions': versions}), 410
+    
+    return jsonify(get_epg_delta(epg_id, since, version))
+
+
+@app.route('/api/epg-files/<epg_id>/guide/now', methods=['GET'])
+def get_guide_now(epg_id):
+    """Now/next per channel (?channels=a,b to limit the channels, ?at=<time> for another time)"""
+    db = open_guide_index(epg_id)
+    if db is None:
+        return jsonify({'error': 'Guide index not found'}), 404
+    
+    try:
+        at = parse_guide_time(request.args.get('at'), int(time.time()))
+        channels = request.args.get('channels')
+        channel_ids = [c for c in channels.split(',') if c] if channels else None
+        return jsonify({'at': format_guide_time(at), 'channels': get_guide_now_next(db, at, channel_ids)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close()
+
+
+@app.route('/api/epg-files/<epg_id>/guide/channels', methods=['GET'])
+def get_guide_channels(epg_id):
+    """List the channels of a merged EPG file"""
+    db = open_guide_index(epg_id)
+    if db is None:
+        return jsonify({'error': 'Guide index not found'}), 404
+    
+    try:
+        return jsonify([format_guide_channel(db, row) for row in db.execute("SELECT * FROM channels ORDER BY id")])
+    finally:
+        db.close()
+
+
+@app.route('/api/epg-files/<epg_id>/guide/channels/<path:channel_id>', methods=['GET'])
+def get_guide_schedule(epg_id, channel_id):
+    """Schedule of a channel between ?start= (default now) and ?end= (default 24 hours later)"""
+    db = open_guide_index(epg_id)
+    if db is None:
+        return jsonify({'error': 'Guide index not found'}), 404
+    
+    try:
+        start = parse_guide_time(request.args.get('start'), int(time.time()))
+        end = parse_guide_time(request.args.get('end'), start + 86400)
+        channel = db.execute("SELECT * FROM channels WHERE id = ?", (channel_id,)).fetchone()
+        if channel is None:
+            return jsonify({'error': 'Channel not found'}), 404
+        
+        # Include the programme that is airing at the start of the range
+        rows = db.execute(
+            "SELECT * FROM programmes WHERE channel = ? AND start < ? AND "
+            "start >= (SELECT COALESCE(MAX(start), ?) FROM programmes WHERE channel = ? AND start <= ?) "
+            "ORDER BY start LIMIT ?",
+            (channel_id, end, start, channel_id, start, GUIDE_SCHEDULE_LIMIT)).fetchall()
+        return jsonify({
+            'channel': format_guide_channel(db, channel),
+            'start': format_guide_time(start),
+            'end': format_guide_time(end),
+            'programmes': [format_guide_programme(db, row) for row in rows if row['stop'] is None or row['stop'] > start]
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close()
+
+
+@app.route('/api/epg-files/<epg_id>/guide/search', methods=['GET'])
+def search_guide(epg_id):
+    """
+    Search programme titles and descriptions (?q=, optional ?channel=, ?start=, ?end=, ?limit=).
+    Matches programmes containing every word of the query, as a word or a word prefix.
+    """
+    query = request.args.get('q', '').strip()
+    words = re.findall(r'\w+', query)
+    if not words:
+        return jsonify({'error': 'q is required'}), 400
+    
+    db = open_guide_index(epg_id)
+    if db is None:
+        return jsonify({'error': 'Guide index not found'}), 404
+    
+    try:
+        start = parse_guide_time(request.args.get('start'), int(time.time()))
+        end = parse_guide_time(request.args.get('end'))
+        limit = min(max(1, int(request.args.get('limit', 50))), GUIDE_SEARCH_LIMIT)
+        
+        sql = ("SELECT programmes.* FROM programmes_search "
+               "JOIN programmes ON programmes.id = programmes_search.rowid "
+               "WHERE programmes_search MATCH ? AND (stop IS NULL OR stop > ?)")
+        params = [' '.join(f'"{word}"*' for word in words), start]
+        if end is not None:
+            sql += " AND start < ?"
+            params.append(end)
+        if request.args.get('channel'):
+            sql += " AND channel = ?"
+            params.append(request.args['channel'])
+        sql += " ORDER BY start LIMIT ?"
+        params.append(limit)
+        
+        return jsonify({'query': query, 'programmes': [format_guide_programme(db, row) for row in db.execute(sql, params)]})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close()
+
+
 @app.route('/api/schedule', methods=['POST'])
 def update_schedule():
     """Update schedule interval"""
@@ -594,11 +3785,14 @@ def update_schedule():
     if not interval or interval < 60:
         return jsonify({'error': 'Interval must be at least 60 seconds'}), 400
     
-    config = load_config()
-    config['schedule_interval'] = interval
-    save_config(config)
+    def apply(config):
+        config['schedule_interval'] = interval
     
-    schedule_merge_job()
+    update_config(apply)
+    
+    # Other workers pass the change on to the leader through config.json
+    if is_scheduler_leader():
+        schedule_merge_job()
     
     return jsonify({'success': True})
 
@@ -622,27 +3816,70 @@ def get_version():
 
 @app.route('/api/job-status', methods=['GET'])
 def get_job_status_api():
-    """Get current job status"""
-    status = get_job_status()
-    
-    # Calculate progress percentage
-    if status['total_steps'] > 0:
-        status['progress_percentage'] = int((status['progress'] / status['total_steps']) * 100)
-    else:
-        status['progress_percentage'] = 0
-    
-    # Calculate elapsed time
-    if status['start_time']:
-        start_time = datetime.fromisoformat(status['start_time'])
-        if status['end_time']:
-            end_time = datetime.fromisoformat(status['end_time'])
-            status['elapsed_time'] = str(end_time - start_time)
-        else:
-            status['elapsed_time'] = str(datetime.now() - start_time)
-    else:
-        status['elapsed_time'] = None
+    """Get the status of the running job, or of the most recent job when idle"""
+    return jsonify(get_job_status())
+
+
+@app.route('/api/job-status/stream', methods=['GET'])
+def stream_job_status():
+    """
+    Stream job status changes as Server-Sent Events.
+    An event is only sent when the status actually changed. Streams end after a few
+    minutes and the browser reconnects, so a worker thread is never held forever.
+    """
+    def generate():
+        version = None
+        last_status = None
+        last_sent = time.time()
+        deadline = time.time() + JOB_STREAM_MAX_DURATION
+        yield "retry: 2000\n\n"
+        
+        while time.time() < deadline:
+            with jobs_changed:
+                jobs_changed.wait_for(lambda: job_events['version'] != version, timeout=1)
+                version = job_events['version']
+            
+            # Jobs of other workers are picked up by the timeout above
+            status = get_job_status()
+            comparable = {key: value for key, value in status.items()
+                          if key not in ('elapsed_time', 'elapsed_seconds')}
+            if comparable != last_status:
+                last_status = comparable
+                last_sent = time.time()
+                yield f"data: {json.dumps(status)}\n\n"
+            elif time.time() - last_sent > JOB_STREAM_KEEPALIVE:
+                last_sent = time.time()
+                yield ": keepalive\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metrics of all worker processes in the Prometheus text format"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/logos/<digest>', methods=['GET'])
+def get_logo(digest):
+    """Serve a cached channel logo"""
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        return "Logo not found", 404
+    try:
+        with open(LOGOS_DIR / f"{digest}.json", 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return "Logo not found", 404
     
-    return jsonify(status)
+    response = send_file(LOGOS_DIR / digest, mimetype=meta['content_type'], etag=digest, conditional=True,
+                         max_age=LOGO_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 # Legacy download route for backward compatibility
@@ -657,7 +3894,7 @@ def download_epg():
         epg_file_path = EPG_FILES_DIR / f"{epg_id}.xml"
         if epg_file_path.exists():
             epg_name = epg_files[0].get('name', 'epg_file')
-            return send_file(epg_file_path, as_attachment=True, download_name=f'{epg_name}.xml')
+            return send_epg_output(epg_id, epg_name)
     
     return "No EPG files available. Please create an EPG file and add sources first.", 404
 
@@ -681,9 +3918,9 @@ def test_source(source_id):
     
     try:
         print(f"Testing source: {url}")
-        xml_root = fetch_xml(url)
+        payload_path = fetch_source(url, source_id)
         
-        if xml_root is None:
+        if payload_path is None:
             return jsonify({
                 'success': False,
                 'error': 'Failed to fetch or parse XML',
@@ -693,14 +3930,20 @@ def test_source(source_id):
         
         # Update the last_fetched timestamp for this source
         update_source_last_fetched(source_id)
+        flush_source_last_fetched()
         
-        channels = xml_root.findall('channel')
-        programmes = xml_root.findall('programme')
+        channels = 0
+        programmes = 0
+        for element in iter_xmltv_elements(payload_path):
+            if element.tag == 'channel':
+                channels += 1
+            elif element.tag == 'programme':
+                programmes += 1
         
         return jsonify({
             'success': True,
-            'channels': len(channels),
-            'programmes': len(programmes),
+            'channels': channels,
+            'programmes': programmes,
             'url': url
         })
     except Exception as e:
@@ -713,11 +3956,7 @@ def test_source(source_id):
 
 
 if __name__ == '__main__':
-    # Schedule the merge job on startup
-    config = load_config()
-    if config.get('epg_files'):
-        schedule_merge_job()
-    
     # Run the app
+    start_background_tasks()
     app.run(host='0.0.0.0', port=5000, debug=True)
 
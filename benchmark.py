@@ -0,0 +1,356 @@
+"""
+EPG Merger benchmark.
+
+Generates synthetic XMLTV feeds, serves them from a local HTTP server with adjustable
+latency and bandwidth, and measures the merge, stats and download paths of app.py in
+an isolated data directory. Results are written as JSON so runs can be compared:
+
+    python benchmark.py --sources 4 --channels 200 --programmes 300 --output before.json
+    python benchmark.py --sources 4 --channels 200 --programmes 300 --compare before.json
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import xml.sax.saxutils as saxutils
+import argparse
+import hashlib
+import platform
+import resource
+import statistics
+import tempfile
+import threading
+import random
+import shutil
+import json
+import gzip
+import time
+import sys
+import os
+import io
+
+
+def generate_feed(source_index, channels, programmes, duplicate_ratio, seed):
+    """
+    Generate an XMLTV feed as bytes.
+    The first duplicate_ratio of the channels are shared by all sources with the same
+    schedule, so the programmes of the other sources on them are duplicates; the other
+    channels are unique to the source.
+    """
+    rng = random.Random(seed * 1000 + source_index)
+    shared = int(channels * duplicate_ratio)
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(days=1)
+
+    out = io.StringIO()
+    out.write('<?xml version="1.0" encoding="utf-8"?>\n<tv generator-info-name="benchmark">\n')
+    channel_ids = []
+    for i in range(channels):
+        channel_id = f"shared{i}.bench" if i < shared else f"s{source_index}c{i}.bench"
+        channel_ids.append((channel_id, i < shared))
+        out.write(f'  <channel id="{channel_id}">\n'
+                  f'    <display-name>Channel {i} ({source_index})</display-name>\n'
+                  f'    <icon src="http://logos.invalid/{channel_id}.png"/>\n'
+                  f'  </channel>\n')
+
+    for channel_id, is_shared in channel_ids:
+        # Shared channels get the same schedule in every source
+        schedule_rng = random.Random(channel_id) if is_shared else rng
+        slot_start = start
+        for p in range(programmes):
+            slot_stop = slot_start + timedelta(minutes=schedule_rng.choice((15, 30, 30, 60, 90)))
+            title = saxutils.escape(f"Programme {p} on {channel_id} & more")
+            out.write(f'  <programme start="{slot_start:%Y%m%d%H%M%S} +0000" '
+                      f'stop="{slot_stop:%Y%m%d%H%M%S} +0000" channel="{channel_id}">\n'
+                      f'    <title lang="en">{title}</title>\n'
+                      f'    <desc lang="en">{saxutils.escape("Synthetic description " * 4)}</desc>\n'
+                      f'    <category lang="en">Benchmark</category>\n'
+                      f'  </programme>\n')
+            slot_start = slot_stop
+
+    out.write('</tv>\n')
+    return out.getvalue().encode('utf-8')
+
+
+class FeedServer:
+    """Local HTTP stand-in for the EPG providers, with latency, bandwidth and ETags"""
+
+    def __init__(self, feeds, latency=0.0, bandwidth=0):
+        self.feeds = {name: (data, '"%s"' % hashlib.sha256(data).hexdigest()[:32]) for name, data in feeds.items()}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                feed = server.feeds.get(self.path.lstrip('/'))
+                if feed is None:
+                    self.send_error(404)
+                    return
+                data, etag = feed
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.write_throttled(data)
+
+            def write_throttled(self, data):
+                if not server.bandwidth:
+                    self.wfile.write(data)
+                    return
+                # Send 1/20th of a second worth of data at a time
+                chunk_size = max(1024, server.bandwidth // 20)
+                for i in range(0, len(data), chunk_size):
+                    self.wfile.write(data[i:i + chunk_size])
+                    time.sleep(len(data[i:i + chunk_size]) / server.bandwidth)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size (VmHWM) of this process, so the next reading only
+    covers what ran since. Returns False where the kernel does not support it, in which
+    case peak_rss_kb() reports the peak of the whole run.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def children_peak_rss_kb():
+    """Largest peak resident set size of the finished child processes, in KB"""
+    scale = 1 if sys.platform != 'darwin' else 1 / 1024
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+
+def peak_rss_kb(children_before=0):
+    """
+    Peak resident set size in KB since reset_peak_rss(), of this process and of the child
+    processes that finished since. The children's peak only ever grows, so it counts
+    only when it is above children_before.
+    """
+    own = None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    own = int(line.split()[1])
+    except OSError:
+        pass
+    if own is None:
+        scale = 1 if sys.platform != 'darwin' else 1 / 1024
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = children_peak_rss_kb()
+    return int(max(own, children if children > children_before else 0))
+
+
+def measure(name, func, runs, programmes=None, setup=None, verbose=False):
+    """Run func `runs` times and summarize its wall times, throughput and peak RSS"""
+    reset_peak_rss()
+    children_before = children_peak_rss_kb()
+    times = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        output = sys.stdout if verbose else io.StringIO()
+        with redirect_stdout(output):
+            started = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - started)
+
+    result = {
+        'runs': runs,
+        'wall_time': round(statistics.median(times), 4),
+        'wall_time_min': round(min(times), 4),
+        'wall_time_max': round(max(times), 4),
+        'peak_rss_kb': peak_rss_kb(children_before)
+    }
+    if programmes:
+        result['programmes'] = programmes
+        result['programmes_per_second'] = round(programmes / result['wall_time']) if result['wall_time'] else None
+    print(f"{name:<28} {result['wall_time']:>9.4f}s"
+          + (f" {result['programmes_per_second']:>12,} prog/s" if programmes else ' ' * 20)
+          + f" {result['peak_rss_kb'] / 1024:>9.1f} MB peak")
+    return result
+
+
+def run(args):
+    work_dir = Path(tempfile.mkdtemp(prefix='epg-benchmark-'))
+    repo_dir = Path(__file__).resolve().parent
+
+    print(f"Generating {args.sources} feeds of {args.channels} channels x {args.programmes} programmes...")
+    feeds = {}
+    for i in range(args.sources):
+        data = generate_feed(i, args.channels, args.programmes, args.duplicate_ratio, args.seed)
+        name = f"feed{i}.xml"
+        if args.gzip:
+            data = gzip.compress(data, compresslevel=6)
+            name += '.gz'
+        feeds[name] = data
+    input_programmes = args.sources * args.channels * args.programmes
+
+    try:
+        with FeedServer(feeds, args.latency / 1000, args.bandwidth * 1024) as server:
+            config = {
+                'sources': [{'id': f"src{i}", 'name': f"Feed {i}", 'url': server.url(name), 'enabled': True}
+                            for i, name in enumerate(feeds)],
+                'epg_files': [
+                    {'id': 'all', 'name': 'All feeds', 'sources': [f"src{i}" for i in range(args.sources)]},
+                    {'id': 'first', 'name': 'First feed', 'sources': ['src0']}
+                ],
+                'schedule_interval': 86400,
+                'parse_workers': args.parse_workers
+            }
+            (work_dir / 'data').mkdir()
+            with open(work_dir / 'data' / 'config.json', 'w') as f:
+                json.dump(config, f)
+
+            # app.py keeps its data relative to the working directory
+            os.chdir(work_dir)
+            sys.path.insert(0, str(repo_dir))
+            with redirect_stdout(io.StringIO()):
+                import app as epg_app
+            epg_app.app.root_path = str(work_dir)
+            # Measure the merges alone: no scheduler, leader election or publisher threads
+            epg_app.background_state['started'] = True
+            client = epg_app.app.test_client()
+
+            def clear_caches():
+                for directory in (epg_app.SOURCE_CACHE_DIR, epg_app.FRAGMENTS_DIR):
+                    shutil.rmtree(directory, ignore_errors=True)
+                    directory.mkdir()
+
+            results = {}
+
+            def bench(name, func, programmes=None, setup=None):
+                results[name] = measure(name, func, args.runs, programmes, setup, args.verbose)
+
+            bench('merge_epg_file_cold', lambda: epg_app.merge_epg_file('all'), input_programmes, clear_caches)
+            bench('merge_epg_file_warm', lambda: epg_app.merge_epg_file('all'), input_programmes)
+            bench('merge_all_epg_files_cold', epg_app.merge_all_epg_files,
+                  input_programmes + args.channels * args.programmes, clear_caches)
+            bench('merge_all_epg_files_warm', epg_app.merge_all_epg_files,
+                  input_programmes + args.channels * args.programmes)
+
+            output_programmes = epg_app.get_epg_output_meta('all')['programmes_count']
+            bench('get_epg_file_stats', lambda: epg_app.get_epg_file_stats('all'))
+
+            def download(path, headers=None):
+                response = client.get(path, headers=headers or {})
+                assert response.status_code in (200, 304), response.status_code
+                response.get_data()
+                response.close()
+
+            etag = client.get('/api/epg-files/all/download').headers.get('ETag')
+            bench('download_identity', lambda: download('/api/epg-files/all/download'), output_programmes)
+            bench('download_gzip', lambda: download('/api/epg-files/all/download', {'Accept-Encoding': 'gzip'}),
+                  output_programmes)
+            bench('download_not_modified', lambda: download('/api/epg-files/all/download', {'If-None-Match': etag}))
+            bench('download_legacy', lambda: download('/download'))
+
+            # Publish a delayed job snapshot now, while data/ still is the work directory
+            epg_app.publish_jobs(force=True)
+    finally:
+        os.chdir(repo_dir)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'peak_rss': 'per benchmark' if reset_peak_rss() else 'whole run'
+        },
+        'parameters': {
+            'sources': args.sources,
+            'channels': args.channels,
+            'programmes': args.programmes,
+            'duplicate_ratio': args.duplicate_ratio,
+            'gzip': args.gzip,
+            'latency_ms': args.latency,
+            'bandwidth_kbps': args.bandwidth,
+            'parse_workers': args.parse_workers,
+            'runs': args.runs,
+            'seed': args.seed,
+            'feed_bytes': sum(len(data) for data in feeds.values()),
+            'output_programmes': output_programmes
+        },
+        'results': results
+    }
+
+
+def compare(report, baseline):
+    """Print the wall time of every benchmark relative to a previous report"""
+    if baseline.get('parameters') != report['parameters']:
+        print("Warning: the baseline was run with different parameters")
+    print(f"\n{'benchmark':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        change = (result['wall_time'] / previous['wall_time'] - 1) * 100 if previous['wall_time'] else 0
+        print(f"{name:<28} {previous['wall_time']:>9.4f}s {result['wall_time']:>9.4f}s {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark EPG Merger on synthetic XMLTV feeds')
+    parser.add_argument('--sources', type=int, default=3, help='number of feeds')
+    parser.add_argument('--channels', type=int, default=100, help='channels per feed')
+    parser.add_argument('--programmes', type=int, default=200, help='programmes per channel')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.3,
+                        help='fraction of channels shared (with identical schedules) by all feeds')
+    parser.add_argument('--gzip', action=argparse.BooleanOptionalAction, default=True, help='serve gzipped feeds')
+    parser.add_argument('--latency', type=float, default=0, help='response latency in milliseconds')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bandwidth per download in KB/s (0 = unlimited)')
+    parser.add_argument('--parse-workers', type=int, default=1, help='parse_workers setting of the merge')
+    parser.add_argument('--runs', type=int, default=3, help='repetitions of every benchmark')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the feed generator')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary data directory')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the app')
+    args = parser.parse_args()
+
+    report = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""
+Gunicorn settings, read from the working directory by default.
+
+The app starts nothing when it is imported; every worker starts its scheduler and
+publishers once the app is loaded, after the fork.
+"""
+
+
+def post_worker_init(worker):
+    from app import start_background_tasks
+    start_background_tasks()
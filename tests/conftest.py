@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# app.py keeps its data relative to the working directory
+ROOT = Path(__file__).resolve().parent.parent
+os.chdir(tempfile.mkdtemp(prefix='epg-merger-tests-'))
+sys.path.insert(0, str(ROOT))
+
+import app as epg_app  # noqa: E402
+
+NOW = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def xmltv_time(hours):
+    """An XMLTV time this many hours from the current hour"""
+    return (NOW + timedelta(hours=hours)).strftime('%Y%m%d%H%M%S +0000')
+
+
+@pytest.fixture
+def app_module():
+    return epg_app
+
+
+@pytest.fixture
+def write_feed(tmp_path):
+    """Write an XMLTV feed from channel ids and (channel, start hour, stop hour, title) programmes"""
+    def write(name, channels, programmes, gzipped=False, extra=''):
+        parts = ['<?xml version="1.0" encoding="utf-8"?>\n<tv>']
+        for channel_id in channels:
+            parts.append(f'<channel id="{channel_id}"><display-name>{channel_id}</display-name></channel>')
+        for channel_id, start, stop, title in programmes:
+            channel = f' channel="{channel_id}"' if channel_id is not None else ''
+            parts.append(f'<programme start="{xmltv_time(start)}" stop="{xmltv_time(stop)}"{channel}>'
+                         f'<title>{title}</title></programme>')
+        parts.append(extra)
+        parts.append('</tv>')
+        data = '\n'.join(parts).encode('utf-8')
+        path = tmp_path / (name + ('.xml.gz' if gzipped else '.xml'))
+        path.write_bytes(gzip.compress(data) if gzipped else data)
+        return path
+    return write
+
+
+@pytest.fixture
+def merge(app_module):
+    """
+    Merge an EPG file from local feed paths, keyed by source id, with the given EPG file
+    settings and extra global config
+    """
+    def run(feeds, epg_file_id='test', config_extra=None, **settings):
+        config = {
+            'sources': [{'id': source_id, 'name': source_id, 'url': f'http://feeds.invalid/{source_id}',
+                         'enabled': True} for source_id in feeds],
+            'epg_files': [dict({'id': epg_file_id, 'name': epg_file_id, 'sources': list(feeds)}, **settings)],
+            'schedule_interval': 86400
+        }
+        config.update(config_extra or {})
+        app_module.save_config(config)
+        assert app_module.merge_epg_file(epg_file_id, source_cache=dict(feeds))
+        return app_module.EPG_FILES_DIR / f"{epg_file_id}.xml"
+    return run
+
+
+@pytest.fixture
+def feed_server():
+    """
+    Serve the files in `files` (name -> path) over HTTP with an ETag and Last-Modified,
+    answering matching conditional requests with a 304. The headers and status of every
+    request are recorded in `requests`.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = server.files[self.path.lstrip('/')]
+            data = path.read_bytes()
+            etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+            last_modified = formatdate(path.stat().st_mtime, usegmt=True)
+            status = 304 if self.headers.get('If-None-Match') == etag else 200
+            server.requests.append((dict(self.headers), status))
+            
+            self.send_response(status)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            if status == 200:
+                self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if status == 200:
+                self.wfile.write(data)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.files = {}
+    server.requests = []
+    server.url = lambda name: f"http://127.0.0.1:{server.server_address[1]}/{name}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
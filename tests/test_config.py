@@ -0,0 +1,36 @@
+import threading
+
+
+def test_concurrent_source_adds_are_all_kept(app_module):
+    app_module.save_config({'sources': [], 'epg_files': [], 'schedule_interval': 7200})
+    client = app_module.app.test_client()
+    
+    def add(i):
+        assert client.post('/api/sources', json={'url': f'http://feeds.invalid/{i}.xml'}).status_code == 200
+    
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(app_module.load_config()['sources']) == 20
+    
+    assert client.post('/api/sources', json={'url': 'http://feeds.invalid/0.xml'}).status_code == 400
+    assert len(app_module.load_config()['sources']) == 20
+
+
+def test_updates_of_unknown_ids_are_not_found(app_module):
+    app_module.save_config({'sources': [], 'epg_files': [], 'schedule_interval': 7200})
+    client = app_module.app.test_client()
+    
+    assert client.post('/api/sources/missing/toggle').status_code == 404
+    assert client.post('/api/sources/missing/settings', json={'refresh_interval': 600}).status_code == 404
+    assert client.post('/api/epg-files/missing/sources', json={'sources': []}).status_code == 404
+    assert client.post('/api/epg-files/missing/settings', json={'pretty_print': True}).status_code == 404
+    
+    epg_id = client.post('/api/epg-files', json={'name': 'Guide'}).json['epg_id']
+    assert client.post('/api/epg-files', json={'name': 'Guide'}).status_code == 400
+    assert client.post(f'/api/epg-files/{epg_id}/settings', json={'pretty_print': True}).status_code == 200
+    assert app_module.load_config()['epg_files'][0]['pretty_print'] is True
+    assert client.delete(f'/api/epg-files/{epg_id}').status_code == 200
+    assert app_module.load_config()['epg_files'] == []
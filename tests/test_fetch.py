@@ -0,0 +1,52 @@
+import threading
+import time
+
+
+def test_busy_host_does_not_hold_up_other_hosts(app_module):
+    urls = ['http://slow.invalid/1', 'http://slow.invalid/2', 'http://slow.invalid/3', 'http://fast.invalid/1']
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+    finished = []
+    
+    def fetch(url):
+        host = url.split('/')[2]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), running[host])
+        time.sleep(0.2 if host == 'slow.invalid' else 0.01)
+        with lock:
+            running[host] -= 1
+            finished.append(url)
+        return url.upper()
+    
+    # Two threads: while slow.invalid is at its limit of one, the other thread serves fast.invalid
+    results = app_module.map_per_host(fetch, urls, urls, 2, 1)
+    assert results == [url.upper() for url in urls]
+    assert peak == {'slow.invalid': 1, 'fast.invalid': 1}
+    assert finished[0] == 'http://fast.invalid/1'
+
+
+def test_unchanged_source_is_revalidated_and_reused(app_module, write_feed, feed_server, monkeypatch):
+    feed_server.files['a.xml'] = write_feed('a', ['c1'], [('c1', 0, 1, 'Title')])
+    app_module.save_config({
+        'sources': [{'id': 'conditional', 'name': 'A', 'url': feed_server.url('a.xml'), 'enabled': True}],
+        'epg_files': [{'id': 'conditional', 'name': 'Conditional', 'sources': ['conditional']}],
+        'schedule_interval': 86400
+    })
+    builds = []
+    build_source_fragment = app_module.build_source_fragment
+    monkeypatch.setattr(app_module, 'build_source_fragment',
+                        lambda *args: builds.append(args) or build_source_fragment(*args))
+    
+    assert app_module.merge_epg_file('conditional')
+    assert app_module.merge_epg_file('conditional')
+    
+    (first, first_status), (second, second_status) = feed_server.requests
+    assert 'If-None-Match' not in first and 'If-Modified-Since' not in first
+    assert (first_status, second_status) == (200, 304)
+    assert second['If-None-Match'].startswith('"')
+    assert second['If-Modified-Since'].endswith('GMT')
+    # The stored payload and its fragment were reused instead of parsed again
+    assert len(builds) == 1
+    assert b'Title' in (app_module.EPG_FILES_DIR / 'conditional.xml').read_bytes()
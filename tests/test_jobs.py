@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+
+
+def test_snapshot_of_reused_pid_is_dropped(app_module):
+    # The parent process is alive, but the snapshot was written by an earlier process with its pid
+    pid = os.getppid()
+    path = app_module.JOBS_DIR / f"{pid}.json"
+    path.write_text(json.dumps({'pid': pid, 'start_token': 'earlier-boot:1', 'jobs': []}))
+    assert app_module.read_process_snapshots(app_module.JOBS_DIR, {}) == []
+    assert not path.exists()
+    
+    snapshot = {'pid': pid, 'start_token': app_module.get_process_start_token(pid), 'jobs': []}
+    path.write_text(json.dumps(snapshot))
+    assert app_module.read_process_snapshots(app_module.JOBS_DIR, {}) == [snapshot]
+    path.unlink()
+
+
+def wait_for_job(client, job_id, timeout=10):
+    """Poll a job the way API clients do until it is no longer running"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').json
+        if not job['is_running']:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} still running")
+
+
+def test_merge_requests_share_the_running_job(app_module, write_feed, monkeypatch):
+    feed = write_feed('jobs', ['c1'], [('c1', 0, 1, 'Title')])
+    app_module.save_config({
+        'sources': [{'id': 'jobs', 'name': 'Jobs', 'url': 'http://feeds.invalid/jobs', 'enabled': True}],
+        'epg_files': [{'id': 'jobs', 'name': 'Jobs', 'sources': ['jobs']}],
+        'schedule_interval': 86400
+    })
+    fetching = threading.Event()
+    release = threading.Event()
+    
+    def fetch_source(url, source_id, progress=None):
+        fetching.set()
+        release.wait(10)
+        return feed
+    
+    monkeypatch.setattr(app_module, 'fetch_source', fetch_source)
+    client = app_module.app.test_client()
+    
+    response = client.post('/api/epg-files/jobs/merge')
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+    assert fetching.wait(10)
+    assert client.get(f'/api/jobs/{job_id}').json['status'] == 'running'
+    
+    # A second trigger while the merge runs gets the same job
+    response = client.post('/api/epg-files/jobs/merge')
+    assert response.status_code == 202
+    assert response.json['job_id'] == job_id
+    assert 'already' in response.json['message']
+    
+    release.set()
+    assert wait_for_job(client, job_id)['status'] == 'completed'
+    
+    # Once it is done, a trigger starts a new job
+    response = client.post('/api/epg-files/jobs/merge')
+    assert response.status_code == 202
+    assert response.json['job_id'] != job_id
+    assert wait_for_job(client, response.json['job_id'])['status'] == 'completed'
+    
+    assert client.post('/api/epg-files/missing/merge').status_code == 404
+    assert client.get('/api/jobs/missing').status_code == 404
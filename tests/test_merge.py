@@ -0,0 +1,102 @@
+import gzip
+
+from conftest import xmltv_time
+
+
+def test_programme_without_channel_does_not_fail_merge(app_module, write_feed, merge):
+    feed = write_feed('a', ['c1'], [('c1', 0, 1, 'Kept'), (None, 1, 2, 'No channel')])
+    output = merge({'a': feed})
+    
+    assert b'Kept' in output.read_bytes()
+    client = app_module.app.test_client()
+    schedule = client.get('/api/epg-files/test/guide/channels/c1?start=0&end=9999999999').json
+    assert [programme['title'] for programme in schedule['programmes']] == ['Kept']
+
+
+def test_guide_search_matches_words_in_order_of_start(app_module, write_feed, merge):
+    feed = write_feed('a', ['c1', 'c2'], [
+        ('c1', 2, 3, 'Evening News &amp; Weather'),
+        ('c2', 1, 2, 'Newsround'),
+        ('c1', 0, 1, 'Film'),
+        ('c2', 0, 1, 'Weather')
+    ])
+    merge({'a': feed}, sort_programmes=True)
+    
+    client = app_module.app.test_client()
+    titles = [programme['title'] for programme in
+              client.get('/api/epg-files/test/guide/search?q=news&start=0').json['programmes']]
+    assert titles == ['Newsround', 'Evening News & Weather']
+    titles = [programme['title'] for programme in
+              client.get('/api/epg-files/test/guide/search?q=weather%20news&start=0').json['programmes']]
+    assert titles == ['Evening News & Weather']
+    assert client.get('/api/epg-files/test/guide/search?q=nothing&start=0').json['programmes'] == []
+
+
+def test_sorted_output_keeps_programmes_without_channel(app_module, write_feed, merge):
+    feed = write_feed('a', ['c1'], [('c1', 1, 2, 'Second'), (None, 0, 1, 'No channel'), ('c1', 0, 1, 'First')])
+    # The tiny budget spills every run of programmes to disk
+    data = merge({'a': feed}, config_extra={'sort_memory_budget': 0.0001}, sort_programmes=True).read_bytes()
+    assert data.index(b'No channel') < data.index(b'First') < data.index(b'Second')
+    
+    data = merge({'a': feed}, sort_programmes=True).read_bytes()
+    assert data.index(b'No channel') < data.index(b'First') < data.index(b'Second')
+
+
+def test_serialize_elements_matches_one_at_a_time(app_module):
+    feed = ('<tv>\n <channel id="a&amp;b">\n  <display-name>Café &lt;1&gt;</display-name>\n  <icon src="x"/>\n </channel>\n'
+            ' <programme channel="a&amp;b" start="1"><title>News\n</title><desc/></programme>\n</tv>')
+    for pretty_print in (False, True):
+        batch = app_module.serialize_elements(list(app_module.ET.fromstring(feed)), pretty_print)
+        single = [app_module.serialize_element(element, pretty_print)
+                  for element in app_module.ET.fromstring(feed)]
+        assert batch == single
+        assert b'<!--' not in b''.join(batch)
+
+
+def test_namespaced_attribute_is_declared_in_output(app_module, write_feed, merge):
+    rated = (f'<programme xmlns:x="urn:x" x:rating="5" start="{xmltv_time(1)}" stop="{xmltv_time(2)}" '
+             f'channel="c1"><title>Rated</title></programme>')
+    feed = write_feed('a', ['c1'], [('c1', 0, 1, 'Plain')], extra=rated)
+    for pretty_print in (False, True):
+        root = app_module.ET.parse(merge({'a': feed}, pretty_print=pretty_print)).getroot()
+        assert [element.tag for element in root] == ['channel', 'programme', 'programme']
+        assert root[2].get('{urn:x}rating') == '5'
+
+
+def test_compressible_feed_is_parsed_a_slice_at_a_time(app_module, write_feed, monkeypatch):
+    programmes = [('c1', hour % 24, hour % 24 + 1, 'Same title again') for hour in range(20000)]
+    feed = write_feed('a', ['c1'], programmes, gzipped=True)
+    # The whole feed inflates from a single read of the compressed file
+    assert feed.stat().st_size < app_module.STREAM_CHUNK_SIZE // 10
+    
+    class RecordingTarget(app_module.XMLTVTarget):
+        peak = 0
+        
+        def end(self, tag):
+            super().end(tag)
+            RecordingTarget.peak = max(RecordingTarget.peak, len(self.elements))
+    
+    monkeypatch.setattr(app_module, 'XMLTVTarget', RecordingTarget)
+    assert sum(1 for _ in app_module.iter_xmltv_elements(feed)) == 20001
+    assert RecordingTarget.peak <= app_module.PARSE_FEED_SIZE // 100
+
+
+def test_feed_of_concatenated_gzip_members_is_parsed(app_module, write_feed):
+    data = write_feed('a', ['c1'], [('c1', hour, hour + 1, 'Title') for hour in range(500)]).read_bytes()
+    feed = write_feed('b', [], [])
+    feed.write_bytes(gzip.compress(data[:len(data) // 2]) + gzip.compress(data[len(data) // 2:]))
+    assert sum(1 for _ in app_module.iter_xmltv_elements(feed)) == 501
+
+
+def test_programme_index_drops_duplicates_in_any_order(app_module):
+    index = app_module.ProgrammeIndex()
+    # Reverse order, with one exact duplicate within the source
+    assert [index.add('c1', start, start + 10) for start in (40, 30, 20, 30, 10)] == [True, True, True, False, True]
+    # A different stop at the same start is not a duplicate
+    assert index.add('c1', 10, 15)
+    index.end_source()
+    
+    # A lower priority source only keeps programmes outside the covered time
+    assert not index.add('c1', 45, 60)
+    assert index.add('c1', 50, 60)
+    assert index.add('c2', 10, 20)
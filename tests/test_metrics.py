@@ -0,0 +1,16 @@
+import re
+
+
+def test_every_recorded_metric_is_defined(app_module):
+    source = open(app_module.__file__).read()
+    names = set(re.findall(r"(?:inc|set|observe)_metric\(\s*'(\w+)'", source))
+    assert names
+    assert names <= set(app_module.METRIC_DEFINITIONS)
+
+
+def test_logo_metrics_are_rendered(app_module):
+    app_module.inc_metric('epg_logo_fetches_total', result='failed')
+    app_module.inc_metric('epg_logo_download_bytes_total', 10)
+    text = app_module.app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'epg_logo_fetches_total{result="failed"}' in text
+    assert 'epg_logo_download_bytes_total' in text
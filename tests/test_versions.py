@@ -0,0 +1,33 @@
+from conftest import xmltv_time
+
+
+def test_delta_reports_the_changed_programme(app_module, write_feed, merge):
+    kept = [('c1', 0, 1, 'First'), ('c1', 3, 4, 'Third')]
+    merge({'versions': write_feed('versions', ['c1'], kept + [('c1', 1, 2, 'Second')])}, epg_file_id='versions')
+    merge({'versions': write_feed('versions', ['c1'], kept + [('c1', 2, 3, 'Moved')])}, epg_file_id='versions')
+    
+    client = app_module.app.test_client()
+    versions = client.get('/api/epg-files/versions/versions').json
+    assert [version['version'] for version in versions] == [2, 1]
+    assert [version['programmes_count'] for version in versions] == [3, 3]
+    
+    delta = client.get('/api/epg-files/versions/delta?since=1').json
+    assert (delta['since'], delta['version']) == (1, 2)
+    assert delta['channels'] == {'added': [], 'changed': [], 'removed': []}
+    assert len(delta['programmes']['added']) == 1 and '<title>Moved</title>' in delta['programmes']['added'][0]
+    assert delta['programmes']['changed'] == []
+    assert delta['programmes']['removed'] == [{
+        'channel': 'c1',
+        'start': app_module.format_guide_time(app_module.parse_xmltv_time(xmltv_time(1))),
+        'stop': app_module.format_guide_time(app_module.parse_xmltv_time(xmltv_time(2)))
+    }]
+    
+    empty = client.get('/api/epg-files/versions/delta?since=2').json
+    assert empty['programmes'] == {'added': [], 'changed': [], 'removed': []}
+    assert client.get('/api/epg-files/versions/delta?since=3').status_code == 404
+
+
+def test_element_digest_tells_elements_apart(app_module):
+    title = b'<programme channel="c1"><title>News</title></programme>'
+    assert app_module.element_digest(title) == app_module.element_digest(bytes(title))
+    assert app_module.element_digest(title) != app_module.element_digest(title.replace(b'News', b'Nevs'))